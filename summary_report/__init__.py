@@ -0,0 +1 @@
+default_app_config = 'summary_report.apps.Config'
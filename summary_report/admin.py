@@ -1,12 +1,70 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
 from .models import Batch, Summary, TestPassPercent, MeasurementMean, MeasurementCount, \
     StandardID, MeasurementStandard, MeasurementCorrection
+from .purge import purge_batch
 
-admin.site.register(Batch)
+
+class BatchAdmin(admin.ModelAdmin):
+    # Batches are deleted with purge_batch instead of the ORM, which loads every row of a
+    # batch to delete it (and to list it on the delete confirmation page), see purge.py
+    actions = ['purge']
+
+    def get_actions(self, request):
+        actions = super(BatchAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def _purge_confirmation(self, request, batches, action=None):
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Purge batches?',
+            opts=self.model._meta,
+            batches=batches,
+            action=action,
+            action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+        )
+        return TemplateResponse(request, 'admin/summary_report/batch/purge_confirmation.html',
+                                context)
+
+    def purge(self, request, queryset):
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        if not request.POST.get('post'):
+            return self._purge_confirmation(request, list(queryset), action='purge')
+        batches = list(queryset.values_list('pk', 'batch_id'))
+        for batch_id, name in batches:
+            purge_batch(batch_id)
+        self.message_user(request, 'Purged %s.' % ', '.join(name for batch_id, name in batches))
+    purge.short_description = 'Purge selected batches and all of their data'
+
+    def delete_model(self, request, obj):
+        purge_batch(obj.pk)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        batch = self.get_object(request, unquote(object_id))
+        if batch is None:
+            return HttpResponseRedirect(reverse('admin:summary_report_batch_changelist'))
+        if not self.has_delete_permission(request, batch):
+            raise PermissionDenied
+        if request.method != 'POST' or not request.POST.get('post'):
+            return self._purge_confirmation(request, [batch])
+        self.log_deletion(request, batch, str(batch))
+        self.delete_model(request, batch)
+        self.message_user(request, 'Purged %s.' % batch.batch_id)
+        return HttpResponseRedirect(reverse('admin:summary_report_batch_changelist'))
+
+
+admin.site.register(Batch, BatchAdmin)
 admin.site.register(Summary)
 admin.site.register(TestPassPercent)
 admin.site.register(MeasurementMean)
 admin.site.register(MeasurementCount)
 admin.site.register(StandardID)
 admin.site.register(MeasurementStandard)
-admin.site.register(MeasurementCorrection)
\ No newline at end of file
+admin.site.register(MeasurementCorrection)
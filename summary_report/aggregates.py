@@ -0,0 +1,170 @@
+from django.db import connection
+from .models import Summary, MeasurementMean, MeasurementCount, TestPassPercent
+from .results import result_map
+
+
+# Non-value columns shared by the measurement tables
+KEY_FIELDS = ('id', 'batch', 'summary', 'overall_result', 'date')
+
+# Value fields in model order. MeasurementCount mirrors MeasurementMean.
+MEAN_FIELDS = [field.name for field in MeasurementMean._meta.concrete_fields
+               if field.name not in KEY_FIELDS]
+TEST_FIELDS = [field.name for field in TestPassPercent._meta.concrete_fields
+               if field.name not in KEY_FIELDS]
+
+# Report categories in display order
+CATEGORIES = ('inspected', 'good', 'fail', 'fail_od', 'fail_backward', 'fail_na')
+
+# Maps url category to the overall_result it filters on ('inspected' takes all rows).
+CATEGORY_RESULTS = {
+    'inspected': None,
+    'good': 'Good',
+    'fail': 'Fail',
+    'fail_od': 'Fail - OD Envelope',
+    'fail_backward': 'backwards',
+    'fail_na': 'N/A',
+}
+
+# weight_map used to determine weight of a test row (Summary count field) when averaging.
+WEIGHT_MAP = {
+    'Good': 'good',
+    'Fail': 'fail_general',
+    'Fail - OD Envelope': 'fail_od',
+    'Backwards': 'fail_backward',
+    'N/A': 'n_a',
+}
+
+
+def _column(model, field_name):
+    return connection.ops.quote_name(model._meta.get_field(field_name).column)
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _where(alias, batch, segment, overall_result):
+    clauses = ['{0}.batch_id = %s'.format(alias)]
+    params = [batch]
+    if segment:
+        clauses.append('{0}.summary_id = %s'.format(alias))
+        params.append(segment)
+    if overall_result is not None:
+        # Stored as its code, see fields.ResultField
+        clauses.append('{0}.overall_result = %s'.format(alias))
+        params.append(result_map.code(overall_result))
+    return ' AND '.join(clauses), params
+
+
+def _weight_case():
+    whens = []
+    params = []
+    for result, attr in WEIGHT_MAP.items():
+        whens.append('WHEN %s THEN s.{0}'.format(_column(Summary, attr)))
+        params.append(result_map.code(result))
+    return 'CASE t.overall_result {0} ELSE 0 END'.format(' '.join(whens)), params
+
+
+def measurement_stats_sql(batch, segment=None, overall_result=None):
+    where, params = _where('c', batch, segment, overall_result)
+    selects = []
+    for field in MEAN_FIELDS:
+        mean_col = 'm.' + _column(MeasurementMean, field)
+        count_col = 'c.' + _column(MeasurementCount, field)
+        selects.append('COALESCE(SUM({0}), 0)'.format(count_col))
+        selects.append('COALESCE(SUM({0} * {1}) / NULLIF(SUM({1}), 0), 0)'
+                       .format(mean_col, count_col))
+    sql = ('SELECT {selects} FROM {counts} c '
+           'LEFT JOIN {means} m ON m.batch_id = c.batch_id AND m.summary_id = c.summary_id '
+           'AND m.overall_result = c.overall_result '
+           'WHERE {where}').format(selects=', '.join(selects),
+                                   counts=_table(MeasurementCount),
+                                   means=_table(MeasurementMean),
+                                   where=where)
+    return sql, params
+
+
+def measurement_stats(batch, segment=None, overall_result=None):
+    """
+    Count-weighted means and count totals for every MeasurementMean field, computed as
+    SUM(mean * count) / SUM(count) in a single joined query.
+    Returns (means_dict, counts_dict).
+    """
+    sql, params = measurement_stats_sql(batch, segment, overall_result)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    counts_dict = {}
+    means_dict = {}
+    for i, field in enumerate(MEAN_FIELDS):
+        counts_dict[field] = row[2 * i]
+        means_dict[field] = row[2 * i + 1]
+    return means_dict, counts_dict
+
+
+def test_stats_sql(batch, segment=None, overall_result=None):
+    where, params = _where('t', batch, segment, overall_result)
+    weight, weight_params = _weight_case()
+    selects = ['COALESCE(SUM({0}), 0)'.format(weight)]
+    select_params = list(weight_params)
+    for field in TEST_FIELDS:
+        test_col = 't.' + _column(TestPassPercent, field)
+        # Pass percentages are stored as integer basis points
+        selects.append('COALESCE(SUM({0} * {1}) / 100.0 / NULLIF(SUM({1}), 0), 0)'
+                       .format(test_col, weight))
+        select_params += weight_params * 2
+    sql = ('SELECT {selects} FROM {tests} t '
+           'INNER JOIN {summaries} s ON s.id = t.summary_id '
+           'WHERE {where}').format(selects=', '.join(selects),
+                                   tests=_table(TestPassPercent),
+                                   summaries=_table(Summary),
+                                   where=where)
+    return sql, select_params + params
+
+
+def test_stats(batch, segment=None, overall_result=None):
+    """
+    Test pass percentages weighted by the Summary count matching each row's overall_result.
+    Returns (tests_dict, tests_count_sum).
+    """
+    sql, params = test_stats_sql(batch, segment, overall_result)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    tests_dict = {field: row[i + 1] for i, field in enumerate(TEST_FIELDS)}
+    return tests_dict, row[0]
+
+
+def segment_stats(batch, segment=None, overall_result=None):
+    """
+    Full stats for one report as (means_dict, counts_dict, tests_dict, tests_count_sum).
+    """
+    means_dict, counts_dict = measurement_stats(batch, segment, overall_result)
+    tests_dict, tests_count_sum = test_stats(batch, segment, overall_result)
+    return means_dict, counts_dict, tests_dict, tests_count_sum
+
+
+def merge_stats(parts):
+    """
+    Combine (means_dict, counts_dict, tests_dict, tests_count_sum) tuples of disjoint row
+    sets into the stats of their union, using the same weighting as the aggregate queries.
+    """
+    weighted_means = {field: 0 for field in MEAN_FIELDS}
+    counts_dict = {field: 0 for field in MEAN_FIELDS}
+    weighted_tests = {field: 0 for field in TEST_FIELDS}
+    tests_count_sum = 0
+    for means, counts, tests, count in parts:
+        for field in MEAN_FIELDS:
+            weighted_means[field] += float(means[field]) * counts[field]
+            counts_dict[field] += counts[field]
+        for field in TEST_FIELDS:
+            weighted_tests[field] += float(tests[field]) * count
+        tests_count_sum += count
+
+    means_dict = {field: weighted_means[field] / counts_dict[field] if counts_dict[field] else 0
+                  for field in MEAN_FIELDS}
+    tests_dict = {field: weighted_tests[field] / tests_count_sum if tests_count_sum else 0
+                  for field in TEST_FIELDS}
+    return means_dict, counts_dict, tests_dict, tests_count_sum
@@ -0,0 +1,186 @@
+import hashlib
+import hmac
+import json
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Max
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+from .aggregates import CATEGORY_RESULTS, MEAN_FIELDS
+from .buffer import BufferFull, BufferTooLarge, ingest_buffer
+from .csis import ExportError, parse_rows
+from .models import Batch, BatchMonth, ControlChart
+from .views import batch_key, batch_totals, segment_page, stats_context
+from . import report_cache, sketches, spc
+
+# JSON versions of the report pages. Responses carry an ETag and Last-Modified taken from
+# Batch.modified, so polling clients get a 304 until the batch's data changes.
+
+
+def _batch_modified(request, batch, **kwargs):
+    return Batch.objects.filter(batch_id=batch).values_list('modified', flat=True).first()
+
+
+def _month_modified(request, year, month):
+    return (BatchMonth.objects
+            .filter(year=year, month=month)
+            .aggregate(Max('batch__modified'))['batch__modified__max'])
+
+
+def _etag(last_modified_func):
+    def etag_func(request, *args, **kwargs):
+        modified = last_modified_func(request, *args, **kwargs)
+        if modified is None:
+            return None
+        return hashlib.md5((request.get_full_path() + modified.isoformat()).encode()).hexdigest()
+    return etag_func
+
+
+@login_required
+@condition(etag_func=_etag(_batch_modified), last_modified_func=_batch_modified)
+def stats_json(request, category, batch, segment):
+    context = dict(report_cache.get_report(category, batch_key(batch), segment, stats_context))
+    context['segment'] = str(context['segment'])
+    return JsonResponse(context)
+
+
+@login_required
+@condition(etag_func=_etag(_batch_modified), last_modified_func=_batch_modified)
+def batch_summary_json(request, batch):
+    fields = ('id', 'date', 'time', 'inspected', 'good', 'good_percent', 'fail_general',
+              'fail_gen_percent', 'fail_od', 'fail_od_percent', 'fail_backward',
+              'fail_backward_percent', 'n_a', 'n_a_percent')
+    key = batch_key(batch)
+    segments, next_after = segment_page(key, request.GET.get('after'), values=fields)
+    return JsonResponse({'batch': batch,
+                         'totals': batch_totals(key),
+                         'segments': segments,
+                         'next_after': next_after,
+                         })
+
+
+@login_required
+@condition(etag_func=_etag(_month_modified), last_modified_func=_month_modified)
+def month_json(request, year, month):
+    batches = (BatchMonth.objects
+               .filter(year=year, month=month)
+               .order_by('batch__batch_id')
+               .values_list('batch__batch_id', flat=True))
+    return JsonResponse({'year': year, 'month': month, 'batches': list(batches)})
+
+
+# Percentiles reported when the request names none
+DEFAULT_PERCENTS = (50, 95, 99)
+
+
+def _percentiles_response(request, **filters):
+    # ?field=<measurement>&p=<percent>&category=<category>, field and p may repeat
+    fields = request.GET.getlist('field')
+    category = request.GET.get('category', 'inspected')
+    try:
+        percents = [float(p) for p in request.GET.getlist('p')] or DEFAULT_PERCENTS
+    except ValueError:
+        return JsonResponse({'error': 'invalid percent'}, status=400)
+    if (not fields or not set(fields) <= set(MEAN_FIELDS)
+            or category not in CATEGORY_RESULTS
+            or not all(0 <= p <= 100 for p in percents)):
+        return JsonResponse({'error': 'invalid field, percent or category'}, status=400)
+    values = sketches.percentiles(fields, percents, CATEGORY_RESULTS[category], **filters)
+    return JsonResponse({'category': category,
+                         'percents': list(percents),
+                         'percentiles': values,
+                         })
+
+
+@login_required
+@condition(etag_func=_etag(_month_modified), last_modified_func=_month_modified)
+def month_percentiles_json(request, year, month):
+    # Filtered on the sketches' own date, their partition key
+    return _percentiles_response(request, date__year=year, date__month=month)
+
+
+@login_required
+@condition(etag_func=_etag(_batch_modified), last_modified_func=_batch_modified)
+def batch_percentiles_json(request, batch):
+    return _percentiles_response(request, batch_id=batch_key(batch))
+
+
+# Chart points returned by default, and at most
+CHART_POINTS = 100
+MAX_CHART_POINTS = 1000
+
+
+def _chart_modified(request, metric, batch):
+    return (ControlChart.objects
+            .filter(batch__batch_id=batch, metric=metric)
+            .values_list('modified', flat=True)
+            .first())
+
+
+@login_required
+@condition(etag_func=_etag(_chart_modified), last_modified_func=_chart_modified)
+def chart_json(request, metric, batch):
+    # Last ?points=<n> points of a batch's control chart and its limits, see spc.py
+    chart = get_object_or_404(ControlChart, batch_id=batch_key(batch), metric=metric)
+    try:
+        last = min(int(request.GET.get('points', CHART_POINTS)), MAX_CHART_POINTS)
+    except ValueError:
+        return JsonResponse({'error': 'invalid points'}, status=400)
+    return JsonResponse(spc.chart_data(chart, max(last, 0)))
+
+
+def _station_authorized(request):
+    # Stations send "Authorization: Token <token>" with a token from CSIS_INGEST_TOKENS
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme != 'Token' or not token:
+        return False
+    return any(hmac.compare_digest(token.encode(), allowed.encode())
+               for allowed in getattr(settings, 'CSIS_INGEST_TOKENS', ()))
+
+
+def _decode_rows(request):
+    if request.content_type in ('application/msgpack', 'application/x-msgpack'):
+        import msgpack
+        rows = msgpack.unpackb(request.body, raw=False)
+    else:
+        rows = json.loads(request.body.decode('utf-8'))
+    # A single export row may be sent on its own
+    return [rows] if isinstance(rows, dict) else rows
+
+
+@csrf_exempt
+@require_POST
+def ingest(request):
+    """
+    Push endpoint for the inspection stations. The body is a JSON (or msgpack) list of
+    rows in the CSIS export layout (see csis.py), holding one or many segments. Segments
+    are queued and written in batches; 429 with Retry-After means the writer is behind,
+    413 that the push holds more segments than are ever queued at once.
+    """
+    if not _station_authorized(request):
+        response = JsonResponse({'error': 'invalid token'}, status=401)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+    try:
+        rows = _decode_rows(request)
+    except ImportError:
+        return JsonResponse({'error': 'msgpack is not installed'}, status=415)
+    except ValueError:
+        return JsonResponse({'error': 'malformed body'}, status=400)
+    try:
+        segments = parse_rows(rows)
+    except (ExportError, AttributeError, TypeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        ingest_buffer.put(segments)
+    except BufferTooLarge as e:
+        return JsonResponse({'error': 'at most %d segments per push' % e.max_pending},
+                            status=413)
+    except BufferFull as e:
+        response = JsonResponse({'error': 'busy'}, status=429)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    return JsonResponse({'accepted': len(segments)}, status=202)
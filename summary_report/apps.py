@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def _create_upcoming_partitions(sender, **kwargs):
+    from .partitions import ensure_upcoming
+    ensure_upcoming()
 
 
 class Config(AppConfig):
     name = 'summary_report'
+
+    def ready(self):
+        from . import signals
+        post_migrate.connect(_create_upcoming_partitions, sender=self)
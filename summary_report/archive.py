@@ -0,0 +1,179 @@
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .models import Batch, ArchivedMonth, Summary, TestPassPercent, MeasurementMean, \
+    MeasurementCount, MeasurementSketch, StatsRollup, ControlChart, ControlPoint
+from .columnar import batch_columns
+from .counters import batch_dates
+from .rollups import refresh_batch
+from . import report_cache, spc
+
+# Closed batches are moved out of the live Summary and measurement tables into one
+# ArchivedMonth row per batch and month, holding the rows as zlib-compressed JSON. What the
+# batch summary and stats pages read stays live: the rollups, the Batch counters and the
+# calendar index. Archived segments are read back from the archive (decompressed once per
+# batch, then cached), and loading segments into an archived batch restores it first.
+# Charts, percentiles and capability only cover live batches: a batch's control charts are
+# dropped when it's archived and rebuilt when it's restored.
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'CSIS_ARCHIVE_AFTER_DAYS', 183)
+
+MEASUREMENT_MODELS = (TestPassPercent, MeasurementMean, MeasurementCount, MeasurementSketch)
+
+COMPRESS_LEVEL = 9
+
+
+def _attnames(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value, cls=DjangoJSONEncoder).encode(), COMPRESS_LEVEL)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)).decode())
+
+
+def _table_rows(model, rows):
+    return {'fields': _attnames(model), 'rows': [list(row) for row in rows]}
+
+
+def _instances(model, table):
+    # Values were stored as JSON; the fields convert them back
+    fields = [model._meta.get_field(name) for name in table['fields']]
+    return [model(**{field.attname: field.to_python(value)
+                     for field, value in zip(fields, row)})
+            for row in table['rows']]
+
+
+def _rows_by_month(model, filters):
+    # {(year, month): [row, ...]} of a table's rows, by their date
+    names = _attnames(model)
+    date_index = names.index('date')
+    months = {}
+    for row in model.objects.filter(**filters).values_list(*names).iterator():
+        day = row[date_index]
+        months.setdefault((day.year, day.month), []).append(row)
+    return months
+
+
+def archivable(days=ARCHIVE_AFTER_DAYS):
+    """
+    Keys of the live batches closed more than `days` ago: unchanged since, and without
+    segments in the cutoff's month or later.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    return (Batch.objects
+            .filter(archived__isnull=True)
+            .filter(Q(modified__lt=cutoff) | Q(modified__isnull=True))
+            .annotate(last=Max(F('batchmonth__year') * 100 + F('batchmonth__month')))
+            .filter(last__lt=cutoff.year * 100 + cutoff.month)
+            .values_list('pk', flat=True))
+
+
+def is_archived(batch_id):
+    return Batch.objects.filter(pk=batch_id, archived__isnull=False).exists()
+
+
+def _evict(batch_id):
+    batch_columns.invalidate(batch_id)
+    report_cache.evict(batch_id)
+
+
+def archive_batch(batch_id):
+    """
+    Move a batch's Summary and measurement rows to ArchivedMonth rows, deleting the live
+    rows with one statement per table. Batches without rollups get them first.
+    Returns the number of segments archived.
+    """
+    if not StatsRollup.objects.filter(batch_id=batch_id, summary__isnull=True).exists():
+        refresh_batch(batch_id)
+    dates = batch_dates(batch_id)
+    rows = {'batch_id': batch_id}
+    if dates is not None:
+        rows['date__range'] = dates
+
+    with transaction.atomic():
+        if not Batch.objects.select_for_update().filter(pk=batch_id,
+                                                        archived__isnull=True).exists():
+            return 0
+        months = _rows_by_month(Summary, rows)
+        measurements = {key: {} for key in months}
+        for model in MEASUREMENT_MODELS:
+            for key, month_rows in _rows_by_month(model, rows).items():
+                measurements[key][model._meta.model_name] = _table_rows(model, month_rows)
+
+        ArchivedMonth.objects.bulk_create(
+            ArchivedMonth(batch_id=batch_id, year=year, month=month,
+                          segments=len(summaries),
+                          summaries=_pack(_table_rows(Summary, summaries)),
+                          measurements=_pack(measurements[(year, month)]))
+            for (year, month), summaries in months.items())
+
+        # Set based, without the ORM's cascade or the signals that would reset the
+        # counters and rollups
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {0} WHERE chart_id IN (SELECT id FROM {1} WHERE batch_id = %s)'
+                .format(connection.ops.quote_name(ControlPoint._meta.db_table),
+                        connection.ops.quote_name(ControlChart._meta.db_table)),
+                [batch_id])
+            cursor.execute('DELETE FROM {0} WHERE batch_id = %s'.format(
+                connection.ops.quote_name(ControlChart._meta.db_table)), [batch_id])
+            for model in MEASUREMENT_MODELS + (Summary,):
+                sql = 'DELETE FROM {0} WHERE batch_id = %s'.format(
+                    connection.ops.quote_name(model._meta.db_table))
+                params = [batch_id]
+                if dates is not None:
+                    sql += ' AND date BETWEEN %s AND %s'
+                    params.extend(dates)
+                cursor.execute(sql, params)
+        Batch.objects.filter(pk=batch_id).update(archived=timezone.now())
+    _evict(batch_id)
+    return sum(len(summaries) for summaries in months.values())
+
+
+def restore_batch(batch_id):
+    """
+    Move an archived batch's rows back to the live tables, with their ids. Runs in the
+    caller's transaction if there is one. Returns the number of segments restored.
+    """
+    with transaction.atomic():
+        if not Batch.objects.select_for_update().filter(pk=batch_id,
+                                                        archived__isnull=False).exists():
+            return 0
+        months = list(ArchivedMonth.objects.filter(batch_id=batch_id))
+        for archived in months:
+            Summary.objects.bulk_create(_instances(Summary, _unpack(archived.summaries)))
+            tables = _unpack(archived.measurements)
+            for model in MEASUREMENT_MODELS:
+                if model._meta.model_name in tables:
+                    model.objects.bulk_create(
+                        _instances(model, tables[model._meta.model_name]))
+        ArchivedMonth.objects.filter(batch_id=batch_id).delete()
+        Batch.objects.filter(pk=batch_id).update(archived=None)
+        spc.rebuild_charts([batch_id])
+    transaction.on_commit(lambda: _evict(batch_id))
+    return sum(archived.segments for archived in months)
+
+
+def summaries(batch_id):
+    """
+    Unsaved Summary instances of an archived batch's segments, in (date, time, id) order.
+    Decompressed on the first read, then cached until the batch changes.
+    """
+    def build():
+        tables = [_unpack(archived.summaries) for archived in
+                  ArchivedMonth.objects.filter(batch_id=batch_id).only('summaries')]
+        return {'fields': _attnames(Summary),
+                'rows': [row for table in tables for row in table['rows']]}
+    instances = _instances(Summary, report_cache.cached('archived', build, batch_id))
+    return sorted(instances, key=lambda summary: (summary.date, summary.time, summary.pk))
@@ -0,0 +1,179 @@
+import atexit
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import deque
+from django.conf import settings
+from django.db import connection, InterfaceError, OperationalError
+from .ingest import SegmentWriter
+
+logger = logging.getLogger(__name__)
+
+# Pushed segments are written by one thread per process, BATCH_SIZE at a time or every
+# FLUSH_SECONDS. Pushes are refused while MAX_PENDING segments are waiting.
+BATCH_SIZE = getattr(settings, 'CSIS_INGEST_BATCH_SIZE', 200)
+FLUSH_SECONDS = getattr(settings, 'CSIS_INGEST_FLUSH_SECONDS', 2)
+MAX_PENDING = getattr(settings, 'CSIS_INGEST_MAX_PENDING', 2000)
+# Longest wait between writes while the database is unavailable
+MAX_RETRY_SECONDS = 60
+# Accepted segments that can't be written are pickled here, one file per failed write, for
+# `manage.py ingest_spool` to load once fixed. Without it they are only logged.
+SPOOL_DIR = getattr(settings, 'CSIS_INGEST_SPOOL_DIR', None)
+
+# Errors of an unavailable database rather than of the segments written
+RETRY_ERRORS = (InterfaceError, OperationalError)
+
+
+class BufferFull(Exception):
+
+    def __init__(self, retry_after):
+        super(BufferFull, self).__init__('ingest buffer full')
+        self.retry_after = retry_after
+
+
+class BufferTooLarge(Exception):
+
+    def __init__(self, max_pending):
+        super(BufferTooLarge, self).__init__('more segments than the ingest buffer holds')
+        self.max_pending = max_pending
+
+
+def spool(segments):
+    """
+    Keep segments that couldn't be written in a file of SPOOL_DIR.
+    """
+    if not SPOOL_DIR:
+        logger.error('Dropped %d pushed CSIS segments: %s', len(segments),
+                     ', '.join('%s %s %s' % (segment['batch'], segment['date'], segment['time'])
+                               for segment in segments))
+        return
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, uuid.uuid4().hex + '.pickle')
+    with open(path + '.tmp', 'wb') as spool_file:
+        pickle.dump(segments, spool_file)
+    os.replace(path + '.tmp', path)
+    logger.error('Spooled %d pushed CSIS segments to %s', len(segments), path)
+
+
+class IngestBuffer(object):
+    """
+    Bounded in-process buffer between the ingest endpoint and the database. Segments are
+    upserted, so a segment a station re-sends after a timeout isn't duplicated, and a
+    write can be retried. While the database is unavailable segments stay queued and are
+    retried with backoff; segments the database rejects are spooled, see spool().
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS,
+                 max_pending=MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Condition()
+        self._writer = None
+
+    def put(self, segments):
+        """
+        Queue all of the segments, or none of them: raises BufferFull when they don't fit
+        for now, BufferTooLarge when they never will.
+        """
+        if len(segments) > self.max_pending:
+            raise BufferTooLarge(self.max_pending)
+        with self._lock:
+            if len(self._pending) + len(segments) > self.max_pending:
+                # Time to drain what's already waiting, at one batch per flush
+                batches = len(self._pending) // self.batch_size + 1
+                raise BufferFull(retry_after=batches * self.flush_seconds)
+            self._pending.extend(segments)
+            self._start()
+            if len(self._pending) >= self.batch_size:
+                self._lock.notify()
+
+    def _start(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._run, name='csis-ingest-writer')
+            self._writer.daemon = True
+            self._writer.start()
+
+    def _take(self):
+        with self._lock:
+            if len(self._pending) < self.batch_size:
+                self._lock.wait(self.flush_seconds)
+            count = min(len(self._pending), self.batch_size)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _requeue(self, segments):
+        # Back to the head of the queue, in their order
+        with self._lock:
+            self._pending.extendleft(reversed(segments))
+
+    def _run(self):
+        failures = 0
+        while True:
+            segments = self._take()
+            if not segments:
+                continue
+            if self._write(segments):
+                failures = 0
+            else:
+                self._requeue(segments)
+                failures += 1
+                time.sleep(min(self.flush_seconds * 2 ** failures, MAX_RETRY_SECONDS))
+
+    @staticmethod
+    def _write_segments(segments):
+        writer = SegmentWriter(len(segments), upsert=True)
+        writer.add(segments)
+        writer.close()
+
+    def _write(self, segments):
+        """
+        Write segments, returning False when the database is unavailable and they should
+        be retried. Segments the database rejects are written one by one, and those that
+        still fail spooled.
+        """
+        try:
+            self._write_segments(segments)
+            return True
+        except RETRY_ERRORS:
+            logger.warning('Database unavailable, %d pushed CSIS segments requeued',
+                           len(segments), exc_info=True)
+            return False
+        except Exception:
+            logger.exception('Failed to write %d pushed CSIS segments', len(segments))
+        finally:
+            connection.close()
+
+        failed = []
+        for segment in segments:
+            try:
+                self._write_segments([segment])
+            except Exception:
+                failed.append(segment)
+            finally:
+                connection.close()
+        if failed:
+            spool(failed)
+        return True
+
+    def drain(self):
+        """
+        Write everything still queued, in the calling thread.
+        """
+        while True:
+            with self._lock:
+                count = min(len(self._pending), self.batch_size)
+                segments = [self._pending.popleft() for _ in range(count)]
+            if not segments:
+                return
+            # No retrying at exit
+            if not self._write(segments):
+                spool(segments)
+
+
+ingest_buffer = IngestBuffer()
+atexit.register(ingest_buffer.drain)
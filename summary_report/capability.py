@@ -0,0 +1,159 @@
+import math
+from datetime import date, timedelta
+import numpy as np
+from django.db import connection
+from .aggregates import MEAN_FIELDS, CATEGORY_RESULTS
+from .csis import MEASUREMENT_COLUMNS
+from .corrections import correction_map
+from .counters import batch_dates
+from .models import BatchMonth, MeasurementSketch, MeasurementStandard, Summary
+from .results import result_map
+from . import report_cache
+
+# Process capability of the measurements against the limits of a StandardID, from the exact
+# part moments kept with the quantile sketches (see sketches.py). Moments are summed per
+# batch in the database and cached until the batch changes, so a report over many batches
+# is a cache read per batch plus one vectorized pass over every field. Reports over a
+# period (a month, a date range) only sum the segments dated in it.
+
+_erfc = np.vectorize(math.erfc, otypes=[np.float64])
+
+
+def _moments_sql(overall_result, dates):
+    parts = []
+    for field in MEAN_FIELDS:
+        for position in range(3):
+            parts.append("COALESCE(SUM((sketches #>> '{%s,moments,%d}')::float8), 0)"
+                         % (field, position))
+    sql = 'SELECT {0} FROM {1} WHERE batch_id = %s'.format(
+        ', '.join(parts), connection.ops.quote_name(MeasurementSketch._meta.db_table))
+    params = []
+    if dates is not None:
+        # Bounded to the batch's date partitions
+        sql += ' AND date BETWEEN %s AND %s'
+        params.extend(dates)
+    if overall_result is not None:
+        sql += ' AND overall_result = %s'
+        params.append(result_map.code(overall_result))
+    return sql, params
+
+
+def batch_moments(batch, category='inspected', dates=None):
+    """
+    Array of (part count, sum, sum of squares) rows, one column per MEAN_FIELDS field, of
+    a batch's parts in a report category, corrected by the MeasurementCorrection factors.
+    Given (first, last) dates, only of the segments dated between them. Cached until the
+    batch's rows or the corrections change.
+    """
+    bounds = batch_dates(batch)
+    if dates is not None and bounds is not None:
+        if dates[0] <= bounds[0] and bounds[1] <= dates[1]:
+            # The whole batch
+            dates = None
+        else:
+            dates = max(dates[0], bounds[0]), min(dates[1], bounds[1])
+            if dates[0] > dates[1]:
+                return np.zeros((3, len(MEAN_FIELDS)))
+
+    def build():
+        sql, params = _moments_sql(CATEGORY_RESULTS[category], dates or bounds)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [batch] + params)
+            row = cursor.fetchone()
+        # Field-major in the query: field 0 count, sum, squares, field 1 ...
+        moments = np.array(row, dtype=np.float64).reshape(len(MEAN_FIELDS), 3).T
+        version, factors = correction_map.current()
+        return moments * [np.ones(len(MEAN_FIELDS)), factors, factors ** 2]
+    if dates is None:
+        return report_cache.cached('moments', build, batch, category)
+    return report_cache.cached('moments', build, batch, category, *dates)
+
+
+def standard_limits(standard):
+    """
+    (lower, upper, nominal) arrays over MEAN_FIELDS from a StandardID's measurement
+    standards, named by field or by CSIS column. NaN where the standard has no limit.
+    """
+    limits = np.full((3, len(MEAN_FIELDS)), np.nan)
+    for measurement in MeasurementStandard.objects.filter(standard_id=standard):
+        field = MEASUREMENT_COLUMNS.get(measurement.measurement, measurement.measurement)
+        if field in MEAN_FIELDS:
+            index = MEAN_FIELDS.index(field)
+            limits[:, index] = [measurement.min, measurement.max, measurement.nominal]
+    return limits
+
+
+def _value(value):
+    return None if np.isnan(value) else float(value)
+
+
+def capability(moments, limits):
+    """
+    Capability of every field at once: {field: {'count', 'mean', 'sigma', 'cp', 'cpk',
+    'below', 'above', 'out_of_spec'}}, with below/above the fractions of parts predicted
+    outside the lower/upper limit for a normal process. None where it can't be computed,
+    e.g. cp of a field with one limit.
+    """
+    count, total, squares = moments
+    lower, upper, nominal = limits
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        # Sample standard deviation, from the moments
+        sigma = np.sqrt(np.maximum(squares - count * mean ** 2, 0) / (count - 1))
+        cp = (upper - lower) / (6 * sigma)
+        cpk = np.fmin(upper - mean, mean - lower) / (3 * sigma)
+        below = 0.5 * _erfc((mean - lower) / (sigma * math.sqrt(2)))
+        above = 0.5 * _erfc((upper - mean) / (sigma * math.sqrt(2)))
+    out_of_spec = np.where(np.isnan(below), 0, below) + np.where(np.isnan(above), 0, above)
+    out_of_spec[np.isnan(below) & np.isnan(above)] = np.nan
+
+    report = {}
+    for index, field in enumerate(MEAN_FIELDS):
+        report[field] = {
+            'count': int(count[index]),
+            'nominal': _value(nominal[index]),
+            'lower': _value(lower[index]),
+            'upper': _value(upper[index]),
+            'mean': _value(mean[index]),
+            'sigma': _value(sigma[index]),
+            'cp': _value(cp[index]),
+            'cpk': _value(cpk[index]),
+            'below': _value(below[index]),
+            'above': _value(above[index]),
+            'out_of_spec': _value(out_of_spec[index]),
+        }
+    return report
+
+
+def capability_report(batches, standard, category='inspected', dates=None):
+    """
+    Capability over the parts of the given batches, see capability(), or of their segments
+    dated between (first, last) dates.
+    """
+    moments = np.zeros((3, len(MEAN_FIELDS)))
+    for batch in batches:
+        moments += batch_moments(batch, category, dates)
+    return capability(moments, standard_limits(standard))
+
+
+def month_dates(year, month):
+    # (first, last) day of a month
+    year, month = int(year), int(month)
+    following = date(year + month // 12, month % 12 + 1, 1)
+    return date(year, month, 1), following - timedelta(days=1)
+
+
+def month_batches(year, month):
+    # The batches listed on the month's archive page
+    return (BatchMonth.objects
+            .filter(year=year, month=month)
+            .values_list('batch_id', flat=True)
+            .distinct())
+
+
+def range_batches(start, end):
+    # Batches with segments in the date range
+    return (Summary.objects
+            .filter(date__range=(start, end))
+            .values_list('batch_id', flat=True)
+            .distinct())
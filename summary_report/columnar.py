@@ -0,0 +1,217 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .models import Summary, MeasurementMean, MeasurementCount, TestPassPercent
+from .aggregates import MEAN_FIELDS, TEST_FIELDS, WEIGHT_MAP
+from .corrections import correction_map
+from .counters import batch_dates
+from . import report_cache
+
+# Cache bounds, overridable in local_settings.py. Entries are kept under the batch's
+# version in the shared report cache, which every change to the batch's rows bumps (see
+# signals.segments_changed), so every process reloads a changed batch on its next read.
+# Entries also expire after CSIS_COLUMN_CACHE_SECONDS.
+CACHE_BYTES = getattr(settings, 'CSIS_COLUMN_CACHE_BYTES', 64 * 1024 * 1024)
+CACHE_SECONDS = getattr(settings, 'CSIS_COLUMN_CACHE_SECONDS', 300)
+
+
+class BatchColumns(object):
+    """
+    A batch's MeasurementMean, MeasurementCount and TestPassPercent rows held as NumPy
+    columns, so the weighted stats of any category or segment are computed in memory.
+    Means are corrected by the MeasurementCorrection factors as they're loaded. Given
+    summary_ids, only the rows of those segments are loaded.
+    """
+
+    def __init__(self, batch_id, summary_ids=None):
+        self.batch_id = batch_id
+        self.loaded_at = time.time()
+        self.corrections_version, self.factors = correction_map.current()
+
+        # Bounding the dates lets the queries skip other months' partitions
+        rows = {'batch_id': batch_id}
+        dates = batch_dates(batch_id)
+        if dates is not None:
+            rows['date__range'] = dates
+        segment_rows = dict(rows)
+        if summary_ids is not None:
+            rows['summary_id__in'] = segment_rows['pk__in'] = list(summary_ids)
+
+        key_fields = ('summary_id', 'overall_result')
+        means = (MeasurementMean.objects.filter(**rows)
+                 .values_list(*(key_fields + tuple(MEAN_FIELDS))))
+        counts = {row[:2]: row[2:] for row in
+                  MeasurementCount.objects.filter(**rows)
+                  .values_list(*(key_fields + tuple(MEAN_FIELDS)))}
+        tests = (TestPassPercent.objects.filter(**rows)
+                 .values_list(*(key_fields + tuple(TEST_FIELDS))))
+        weights = {row[0]: dict(zip(WEIGHT_MAP.values(), row[1:])) for row in
+                   Summary.objects.filter(**segment_rows)
+                   .values_list('pk', *WEIGHT_MAP.values())}
+
+        # Counts rows are aligned to their means rows; unmatched counts still add to the
+        # totals, the same as the aggregate queries.
+        mean_keys = [row[:2] for row in means]
+        count_rows = [counts.pop(key, (0,) * len(MEAN_FIELDS)) for key in mean_keys]
+        mean_rows = [row[2:] for row in means]
+        for key, row in counts.items():
+            mean_keys.append(key)
+            count_rows.append(row)
+            mean_rows.append((0.0,) * len(MEAN_FIELDS))
+        test_keys = [row[:2] for row in tests]
+
+        self.results = sorted({key[1] for key in mean_keys + test_keys})
+        self.mean_segments, self.mean_results = self._key_columns(mean_keys)
+        self.test_segments, self.test_results = self._key_columns(test_keys)
+        self.means = (np.array(mean_rows, dtype=np.float64).reshape(-1, len(MEAN_FIELDS))
+                      * self.factors)
+        self.counts = np.array(count_rows, dtype=np.int64).reshape(-1, len(MEAN_FIELDS))
+        self.tests = np.array([row[2:] for row in tests],
+                              dtype=np.float64).reshape(-1, len(TEST_FIELDS))
+        self.test_weights = np.array(
+            [weights[summary_id][WEIGHT_MAP[result]] if result in WEIGHT_MAP else 0
+             for summary_id, result in test_keys], dtype=np.int64)
+
+    def _key_columns(self, keys):
+        result_codes = {result: code for code, result in enumerate(self.results)}
+        segments = np.array([key[0] for key in keys], dtype=np.int64)
+        results = np.array([result_codes[key[1]] for key in keys], dtype=np.int16)
+        return segments, results
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (
+            self.mean_segments, self.mean_results, self.test_segments, self.test_results,
+            self.means, self.counts, self.tests, self.test_weights))
+
+    def column(self, field):
+        """
+        The MeasurementMean, MeasurementCount (suffix '_count') or TestPassPercent
+        column for a field name.
+        """
+        if field in TEST_FIELDS:
+            return self.tests[:, TEST_FIELDS.index(field)]
+        if field.endswith('_count'):
+            return self.counts[:, MEAN_FIELDS.index(field[:-len('_count')])]
+        return self.means[:, MEAN_FIELDS.index(field)]
+
+    def _mask(self, segments, results, segment, overall_result):
+        mask = np.ones(len(segments), dtype=bool)
+        if segment:
+            mask &= segments == int(segment)
+        if overall_result is not None:
+            if overall_result not in self.results:
+                return np.zeros(len(segments), dtype=bool)
+            mask &= results == self.results.index(overall_result)
+        return mask
+
+    def stats(self, segment=None, overall_result=None):
+        """
+        Same as aggregates.segment_stats, computed from the cached columns.
+        """
+        mask = self._mask(self.mean_segments, self.mean_results, segment, overall_result)
+        counts = self.counts[mask]
+        count_sums = counts.sum(axis=0)
+        mean_sums = (self.means[mask] * counts).sum(axis=0)
+        means = np.divide(mean_sums, count_sums,
+                          out=np.zeros(len(MEAN_FIELDS)), where=count_sums != 0)
+
+        mask = self._mask(self.test_segments, self.test_results, segment, overall_result)
+        weights = self.test_weights[mask]
+        tests_count_sum = int(weights.sum())
+        test_sums = (self.tests[mask] * weights[:, np.newaxis]).sum(axis=0)
+        tests = test_sums / tests_count_sum if tests_count_sum else np.zeros(len(TEST_FIELDS))
+
+        return (dict(zip(MEAN_FIELDS, means.tolist())),
+                dict(zip(MEAN_FIELDS, count_sums.tolist())),
+                dict(zip(TEST_FIELDS, tests.tolist())),
+                tests_count_sum)
+
+    def segments_stats(self, segment_ids, overall_result=None):
+        """
+        stats() of every given segment at once, as {segment_id: stats}.
+        """
+        segment_ids = np.array(sorted(segment_ids), dtype=np.int64)
+        n = len(segment_ids)
+
+        def group_sum(segments, mask, values):
+            # Rows of segments outside segment_ids are dropped
+            index = np.searchsorted(segment_ids, segments[mask])
+            keep = (index < n) & (segment_ids[np.minimum(index, n - 1)] == segments[mask])
+            sums = np.zeros((n,) + values.shape[1:], dtype=values.dtype)
+            np.add.at(sums, index[keep], values[mask][keep])
+            return sums
+
+        if not n:
+            return {}
+        mask = self._mask(self.mean_segments, self.mean_results, None, overall_result)
+        count_sums = group_sum(self.mean_segments, mask, self.counts)
+        mean_sums = group_sum(self.mean_segments, mask, self.means * self.counts)
+        means = np.divide(mean_sums, count_sums,
+                          out=np.zeros(mean_sums.shape), where=count_sums != 0)
+
+        mask = self._mask(self.test_segments, self.test_results, None, overall_result)
+        weights = group_sum(self.test_segments, mask, self.test_weights)
+        test_sums = group_sum(self.test_segments, mask,
+                              self.tests * self.test_weights[:, np.newaxis])
+        tests = np.divide(test_sums, weights[:, np.newaxis].astype(np.float64),
+                          out=np.zeros(test_sums.shape), where=weights[:, np.newaxis] != 0)
+
+        return {segment_id: (dict(zip(MEAN_FIELDS, means[i].tolist())),
+                             dict(zip(MEAN_FIELDS, count_sums[i].tolist())),
+                             dict(zip(TEST_FIELDS, tests[i].tolist())),
+                             int(weights[i]))
+                for i, segment_id in enumerate(segment_ids.tolist())}
+
+
+class ColumnCache(object):
+    """
+    Per-process LRU of BatchColumns, bounded by the total bytes of the cached arrays.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, max_age=CACHE_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, batch_id):
+        corrections_version = correction_map.version()
+        # Read before loading, so a change during the load isn't missed
+        version = report_cache.version(batch_id)
+        with self._lock:
+            columns = self._entries.get(batch_id)
+            if (columns is not None and time.time() - columns.loaded_at < self.max_age
+                    and columns.corrections_version == corrections_version
+                    and columns.version == version):
+                self._entries.move_to_end(batch_id)
+                return columns
+
+        columns = BatchColumns(batch_id)
+        columns.version = version
+        with self._lock:
+            self._discard(batch_id)
+            if columns.nbytes <= self.max_bytes:
+                self._entries[batch_id] = columns
+                self._bytes += columns.nbytes
+                while self._bytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+        return columns
+
+    def invalidate(self, batch_id):
+        # This process's entry; other processes see the batch's new version
+        with self._lock:
+            self._discard(batch_id)
+
+    def _discard(self, batch_id):
+        columns = self._entries.pop(batch_id, None)
+        if columns is not None:
+            self._bytes -= columns.nbytes
+
+
+batch_columns = ColumnCache()
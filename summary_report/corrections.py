@@ -0,0 +1,113 @@
+import threading
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+
+from .aggregates import MEAN_FIELDS
+from .models import Batch, MeasurementCorrection, StatsRollup
+from . import report_cache
+
+# MeasurementCorrection factors scale the measurement means. They're applied once, when a
+# batch's columns are loaded (see columnar.py), so the rollups store corrected means and
+# reports never look corrections up. Each process keeps the factors in memory under a
+# version held in the shared cache; changing corrections bumps the version, so every
+# process reloads them, and re-applies the new factors to the stored rollups in bulk.
+
+VERSION_KEY = report_cache.KEY_PREFIX + ':corrections'
+
+
+class CorrectionMap(object):
+    """
+    The current correction factor of every MEAN_FIELDS field (1 where there's none).
+    """
+
+    def __init__(self):
+        self._version = None
+        self._factors = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        return cache.get_or_set(VERSION_KEY, uuid4().hex, None)
+
+    def current(self):
+        """
+        (version, factors array over MEAN_FIELDS), reloaded when the version changed.
+        """
+        version = self.version()
+        with self._lock:
+            if version != self._version:
+                self._factors = load_factors()
+                self._version = version
+            return self._version, self._factors
+
+    def invalidate(self):
+        cache.set(VERSION_KEY, uuid4().hex, None)
+
+
+def load_factors():
+    # Imported here, as parsing (csis, sketches) depends on this module
+    from .csis import MEASUREMENT_COLUMNS
+    factors = np.ones(len(MEAN_FIELDS))
+    for measurement, factor in MeasurementCorrection.objects.values_list(
+            'measurement', 'correction_factor'):
+        # Corrections may name the field or its CSIS column
+        field = MEASUREMENT_COLUMNS.get(measurement, measurement)
+        if field in MEAN_FIELDS:
+            factors[MEAN_FIELDS.index(field)] = factor
+    return factors
+
+
+correction_map = CorrectionMap()
+
+
+def factors_dict(factors):
+    return dict(zip(MEAN_FIELDS, factors.tolist()))
+
+
+def recompute_rollups():
+    """
+    Re-apply the current factors to every stored rollup whose means were corrected by
+    other factors, rescaling them in place with one UPDATE per field. (Means zeroed by a
+    factor of 0 can't be rescaled; their batches are rebuilt instead, see zeroed_batches.)
+    Returns the number of fields that changed.
+    """
+    version, factors = correction_map.current()
+    table = connection.ops.quote_name(StatsRollup._meta.db_table)
+    changed = 0
+    with connection.cursor() as cursor:
+        for field, factor in factors_dict(factors).items():
+            # Rollups without a recorded factor were stored uncorrected
+            applied = "COALESCE((factors ->> '{0}')::float8, 1)".format(field)
+            cursor.execute(
+                "UPDATE {table} SET "
+                "means = jsonb_set(means, '{{{field}}}', "
+                "to_jsonb((means ->> '{field}')::float8 * %s / {applied})), "
+                "factors = jsonb_set(factors, '{{{field}}}', to_jsonb(%s::float8)) "
+                "WHERE {applied} NOT IN (%s, 0) AND means ? '{field}'"
+                .format(table=table, field=field, applied=applied),
+                [factor, factor, factor])
+            changed += cursor.rowcount > 0
+    return changed
+
+
+def zeroed_batches():
+    """
+    Keys of the live batches with rollups whose means were zeroed by a factor of 0 that is
+    no longer current, which need rebuilding from their rows.
+    """
+    version, factors = correction_map.current()
+    fields = [field for field, factor in factors_dict(factors).items() if factor != 0]
+    if not fields:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT DISTINCT batch_id FROM {0} WHERE {1}'.format(
+                connection.ops.quote_name(StatsRollup._meta.db_table),
+                ' OR '.join("(factors ->> %s)::float8 = 0" for field in fields)),
+            fields)
+        batch_ids = [row[0] for row in cursor.fetchall()]
+    return list(Batch.objects
+                .filter(pk__in=batch_ids, archived__isnull=True)
+                .values_list('pk', flat=True))
@@ -0,0 +1,72 @@
+from datetime import date
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from .models import Batch, BatchMonth, Summary
+
+# Summary counts kept as running totals on Batch
+COUNTER_FIELDS = ('inspected', 'good', 'fail_general', 'fail_od', 'fail_backward', 'n_a')
+
+
+def summary_totals(batch_id):
+    """
+    Totals of the batch's Summary counts, in one aggregate query.
+    """
+    totals = (Summary.objects
+              .filter(batch_id=batch_id)
+              .aggregate(**{field: Sum(field) for field in COUNTER_FIELDS}))
+    return {field: totals[field] or 0 for field in COUNTER_FIELDS}
+
+
+def add_summary(summary, sign=1):
+    """
+    Add (or with sign=-1, remove) a Summary's counts to its batch's totals and to the
+    calendar index, atomically.
+    """
+    (Batch.objects
+     .filter(pk=summary.batch_id)
+     .update(**{field: F(field) + sign * getattr(summary, field) for field in COUNTER_FIELDS}))
+
+    month = {'batch_id': summary.batch_id,
+             'year': summary.date.year,
+             'month': summary.date.month}
+    if sign > 0:
+        BatchMonth.objects.get_or_create(**month)
+    (BatchMonth.objects
+     .filter(**month)
+     .update(segments=F('segments') + sign, sensors=F('sensors') + sign * summary.inspected))
+    if sign < 0:
+        BatchMonth.objects.filter(segments__lte=0, **month).delete()
+
+
+def recount_batch(batch_id):
+    """
+    Reset the batch's totals and calendar index from its Summary rows, for changes that
+    skip add_summary.
+    """
+    Batch.objects.filter(pk=batch_id).update(**summary_totals(batch_id))
+
+    months = (Summary.objects
+              .filter(batch_id=batch_id)
+              .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+              .values('year', 'month')
+              .annotate(segments=Count('id'), sensors=Sum('inspected')))
+    BatchMonth.objects.filter(batch_id=batch_id).delete()
+    BatchMonth.objects.bulk_create(BatchMonth(batch_id=batch_id, **month) for month in months)
+
+
+def batch_dates(batch_id):
+    """
+    (first, last) day of the months the batch ran in, from the calendar index, or None if
+    it has no segments. Bounds queries by batch to the batch's date partitions.
+    """
+    months = (BatchMonth.objects
+              .filter(batch_id=batch_id)
+              .annotate(key=F('year') * 100 + F('month'))
+              .aggregate(first=Min('key'), last=Max('key')))
+    if months['first'] is None:
+        return None
+    first = date(months['first'] // 100, months['first'] % 100, 1)
+    year, month = divmod(months['last'], 100)
+    # Day before the first of the following month
+    last = date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+    return first, date.fromordinal(last)
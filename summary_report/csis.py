@@ -0,0 +1,185 @@
+import csv
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from .models import Summary, TestPassPercent, MeasurementMean, MeasurementCount
+from .sketches import part_sketches
+
+# CSIS result exports are CSV files with a header row. Every row carries the segment keys
+# (batch, date, time), a `record` column naming what the row holds, and that record's
+# columns under their CSIS names:
+#   summary - the Summary counts and percents, named as the Summary fields
+#   test    - overall_result and the TestPassPercent columns (re_station, ...)
+#   mean    - overall_result and the per-sensor measurement means (re_ida_bright, ...)
+#   count   - overall_result and the non-zero counts of those measurements
+#   part    - overall_result and one inspected part's measurements, blank where the part
+#             wasn't measured; optional, kept only in the raw store (see rawstore.py)
+
+SUMMARY_COLUMNS = OrderedDict((name, name) for name in (
+    'inspected', 'good', 'good_percent', 'fail_general', 'fail_gen_percent', 'fail_od',
+    'fail_od_percent', 'fail_backward', 'fail_backward_percent', 'n_a', 'n_a_percent',
+    'gate_homes', 'lost_homing',
+))
+
+# CSIS column: TestPassPercent field
+TEST_COLUMNS = OrderedDict((
+    ('re_station', 'round_end'),
+    ('fe_station', 'flat_end'),
+    ('odp_station', 'outer_dimension'),
+    ('ss_station', 'sepia_screen'),
+    ('re_valid_master', 'round_valid_master'),
+    ('re_valid', 'round_valid'),
+    ('re_present', 'round_present'),
+    ('re_orientation', 'round_orientation'),
+    ('re_inner_bright', 'round_inner_bright'),
+    ('re_outer_bright', 'round_outer_bright'),
+    ('re_inner_small_dark', 'round_inner_small_dark'),
+    ('re_outer_small_dark', 'round_outer_small_dark'),
+    ('re_inner_large_dark', 'round_inner_large_dark'),
+    ('re_outer_large_dark', 'round_outer_large_dark'),
+    ('fe_valid_master', 'flat_valid_master'),
+    ('fe_orientation', 'flat_orientation'),
+    ('fe_valid', 'flat_valid'),
+    ('fe_inner_diameter', 'flat_ID'),
+    ('fe_obstruction', 'flat_obstruction'),
+    ('fe_chip', 'flat_chip'),
+    ('odp_position', 'dimension_position'),
+    ('odp_length', 'dimension_length'),
+    ('odp_bumps', 'dimension_bumps'),
+    ('odp_chips', 'dimension_chips'),
+    ('odp_envelope', 'dimension_envelope'),
+    ('odp_nose', 'dimension_nose'),
+    ('ss_valid', 'sepia_valid'),
+    ('ss_bright_defect', 'sepia_bright_spot'),
+    ('ss_blemish_defect', 'sepia_blemish'),
+    ('ss_spot_crack_defect', 'sepia_spot_crack'),
+))
+
+# CSIS column: MeasurementMean / MeasurementCount field
+MEASUREMENT_COLUMNS = OrderedDict((
+    ('re_ida_bright', 'round_inner_bright_area'),
+    ('re_ida_large_dark', 'round_inner_large_dark_area'),
+    ('re_ida_small_dark', 'round_inner_small_dark_area'),
+    ('re_oda_bright', 'round_outer_bright_area'),
+    ('re_oda_large_dark', 'round_outer_large_dark_area'),
+    ('re_oda_small_dark', 'round_outer_small_dark_area'),
+    ('fe_inner_dia_min', 'flat_inner_diameter_min'),
+    ('fe_inner_dia_max', 'flat_inner_diameter_max'),
+    ('fe_obstr_area', 'flat_obstruction_area'),
+    ('fe_chip_area', 'flat_chip_area'),
+    ('odp_length_mm', 'dimension_length_mm'),
+    ('odp_max_bump_mm', 'dimension_bump_max'),
+    ('odp_max_chip_mm', 'dimension_chip_max'),
+    ('odp_envelope_mm', 'dimension_envelope_mm'),
+    ('odp_nose_w_min_max', 'dimension_nose_min_max'),
+    ('odp_mdn_od_mm', 'dimension_median_od'),
+    ('ss_bright_da_mm2', 'sepia_bright_area'),
+    ('ss_blemish_da_mm2', 'sepia_blemish_area'),
+    ('ss_spot_crack_da_mm2', 'sepia_spot_crack_area'),
+))
+
+# record: (model, column map, key of the parsed segment it's stored under)
+RECORDS = {
+    'summary': (Summary, SUMMARY_COLUMNS, 'summary'),
+    'test': (TestPassPercent, TEST_COLUMNS, 'tests'),
+    'mean': (MeasurementMean, MEASUREMENT_COLUMNS, 'means'),
+    'count': (MeasurementCount, MEASUREMENT_COLUMNS, 'counts'),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _part_value(row, column, line):
+    value = row.get(column)
+    if value in (None, ''):
+        return float('nan')
+    try:
+        return float(value)
+    except ValueError:
+        raise ExportError('line %d: invalid %s %r' % (line, column, value))
+
+
+def _to_python(field, value, line, column):
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        raise ExportError('line %d: invalid %s %r' % (line, column, value))
+
+
+def _convert(model, columns, row, line):
+    values = {}
+    for column, field_name in columns.items():
+        if row.get(column) in (None, ''):
+            raise ExportError('line %d: missing %s' % (line, column))
+        values[field_name] = _to_python(model._meta.get_field(field_name), row[column],
+                                        line, column)
+    return values
+
+
+def parse_rows(rows):
+    """
+    Group export rows (dicts keyed by CSIS column, values as strings or numbers) into
+    segments:
+        {'batch': str, 'date': date, 'time': time,
+         'summary': {field: value},
+         'tests' / 'means' / 'counts': {overall_result: {field: value}},
+         'parts': {'overall_result': [...], field: [value, ...]},
+         'sketches': {overall_result: {'sketches': {field: sketch}}}}
+    Segments with part records get quantile sketches of them (see sketches.py).
+    Segments are returned in the order they first appear.
+    """
+    date_field = Summary._meta.get_field('date')
+    time_field = Summary._meta.get_field('time')
+    segments = OrderedDict()
+    # line 1 is the header
+    for line, row in enumerate(rows, 2):
+        record = row.get('record')
+        if record not in RECORDS and record != 'part':
+            raise ExportError('line %d: unknown record %r' % (line, record))
+        if not row.get('batch'):
+            raise ExportError('line %d: missing batch' % line)
+        segment_key = (row['batch'], row.get('date'), row.get('time'))
+        segment = segments.get(segment_key)
+        if segment is None:
+            segment = segments[segment_key] = {
+                'batch': row['batch'],
+                'date': _to_python(date_field, row.get('date'), line, 'date'),
+                'time': _to_python(time_field, row.get('time'), line, 'time'),
+                'summary': None, 'tests': {}, 'means': {}, 'counts': {}, 'parts': {},
+            }
+            if segment['date'] is None or segment['time'] is None:
+                raise ExportError('line %d: missing date or time' % line)
+
+        if record == 'part':
+            if not row.get('overall_result'):
+                raise ExportError('line %d: missing overall_result' % line)
+            parts = segment['parts']
+            parts.setdefault('overall_result', []).append(row['overall_result'])
+            for column, field_name in MEASUREMENT_COLUMNS.items():
+                parts.setdefault(field_name, []).append(_part_value(row, column, line))
+            continue
+
+        model, columns, key = RECORDS[record]
+        values = _convert(model, columns, row, line)
+        if key == 'summary':
+            segment['summary'] = values
+        elif not row.get('overall_result'):
+            raise ExportError('line %d: missing overall_result' % line)
+        else:
+            segment[key][row['overall_result']] = values
+
+    for segment in segments.values():
+        if segment['summary'] is None:
+            raise ExportError('segment %s %s %s has no summary record'
+                              % (segment['batch'], segment['date'], segment['time']))
+        segment['sketches'] = part_sketches(segment['parts'])
+    return list(segments.values())
+
+
+def parse_export(path):
+    """
+    Segments of one CSIS export file, see parse_rows.
+    """
+    with open(path, newline='') as export:
+        return parse_rows(csv.DictReader(export))
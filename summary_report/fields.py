@@ -0,0 +1,74 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+
+# Compact column types for the measurement tables, read and written as the values they
+# replaced so callers are unaffected.
+
+
+class ResultField(models.SmallIntegerField):
+    """
+    An overall_result name stored as the smallint code of its OverallResult row. Values,
+    filters and writes all use the name; names are given a code the first time they're
+    saved.
+    """
+
+    def from_db_value(self, value, expression, connection, context):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        from .results import result_map
+        return result_map.name(int(value))
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, int) or hasattr(value, 'resolve_expression'):
+            return value
+        from .results import result_map
+        # A name never stored has no code, and matches no rows
+        return result_map.code(value)
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, str):
+            from .results import result_map
+            return result_map.code(value, create=True)
+        return super(ResultField, self).get_db_prep_save(value, connection)
+
+    @property
+    def validators(self):
+        # Not the smallint range checks, which don't apply to the names
+        return list(self._validators)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, form_class=forms.CharField, max_length=63, **kwargs)
+
+
+class BasisPointsField(models.SmallIntegerField):
+    """
+    A percentage stored as smallint basis points (hundredths of a percent). Values and
+    writes are the percentage, as a float.
+    """
+    default_error_messages = {
+        'invalid': "'%(value)s' value must be a percentage.",
+    }
+
+    def from_db_value(self, value, expression, connection, context):
+        return None if value is None else value / 100.0
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid'], code='invalid',
+                                  params={'value': value})
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return int(round(float(value) * 100))
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, form_class=forms.FloatField, **kwargs)
@@ -0,0 +1,218 @@
+from django.db import connection, transaction
+from .models import Batch, Summary, TestPassPercent, MeasurementMean, MeasurementCount, \
+    MeasurementSketch
+from .aggregates import MEAN_FIELDS, TEST_FIELDS
+from .csis import SUMMARY_COLUMNS
+from . import archive, counters, rawstore
+from .signals import segments_changed
+
+# Segments written per transaction by load_segments
+BATCH_SIZE = 500
+
+# Parsed segment key: model of its rows
+CHILD_MODELS = (
+    ('tests', TestPassPercent),
+    ('means', MeasurementMean),
+    ('counts', MeasurementCount),
+    ('sketches', MeasurementSketch),
+)
+
+# Value fields written for each parsed segment key
+VALUE_FIELDS = {
+    'summary': list(SUMMARY_COLUMNS.values()),
+    'tests': TEST_FIELDS,
+    'means': MEAN_FIELDS,
+    'counts': MEAN_FIELDS,
+    'sketches': ['sketches'],
+}
+
+
+def _create_batches(names):
+    """
+    {batch_id: pk} of the named batches, creating those that don't exist yet.
+    """
+    batches = dict(Batch.objects.filter(batch_id__in=names).values_list('batch_id', 'pk'))
+    # Segments are only written to live batches
+    archived = Batch.objects.filter(batch_id__in=names, archived__isnull=False)
+    for batch_id in archived.values_list('pk', flat=True):
+        archive.restore_batch(batch_id)
+    # PostgreSQL returns the new ids, which bulk_create sets on the instances
+    created = Batch.objects.bulk_create(Batch(batch_id=name) for name in names - set(batches))
+    batches.update((batch.batch_id, batch.pk) for batch in created)
+    return batches
+
+
+def _write_chunk(segments):
+    """
+    Insert a chunk of parsed segments with one bulk INSERT per table, in one transaction.
+    Returns {batch_id: [summary_id, ...]} of the inserted segments.
+    """
+    with transaction.atomic():
+        batches = _create_batches({segment['batch'] for segment in segments})
+
+        summaries = [Summary(batch_id=batches[segment['batch']], date=segment['date'],
+                             time=segment['time'], **segment['summary'])
+                     for segment in segments]
+        # PostgreSQL returns the new ids, which bulk_create sets on the instances
+        Summary.objects.bulk_create(summaries)
+
+        for key, model in CHILD_MODELS:
+            model.objects.bulk_create(
+                model(batch_id=summary.batch_id, summary_id=summary.pk, date=summary.date,
+                      overall_result=overall_result, **values)
+                for summary, segment in zip(summaries, segments)
+                for overall_result, values in segment[key].items()
+            )
+
+        written = {}
+        for summary in summaries:
+            written.setdefault(summary.batch_id, []).append(summary.pk)
+        # bulk_create skips the signals that keep the counters and calendar index
+        for batch_id in written:
+            counters.recount_batch(batch_id)
+    return written
+
+
+def _upsert_sql(model, key_fields, value_fields, row_count, returning=()):
+    quote = connection.ops.quote_name
+    columns = [quote(model._meta.get_field(name).column) for name in key_fields + value_fields]
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    sql = ('INSERT INTO {table} ({columns}) VALUES {values} '
+           'ON CONFLICT ({keys}) DO UPDATE SET {updates}').format(
+        table=quote(model._meta.db_table),
+        columns=', '.join(columns),
+        values=', '.join([placeholders] * row_count),
+        keys=', '.join(columns[:len(key_fields)]),
+        updates=', '.join('{0} = EXCLUDED.{0}'.format(column)
+                          for column in columns[len(key_fields):]),
+    )
+    if returning:
+        sql += ' RETURNING ' + ', '.join(quote(column) for column in returning)
+    return sql
+
+
+def _upsert_chunk(segments):
+    """
+    Insert or replace a chunk of parsed segments, keyed on (batch, date, time), with
+    INSERT ... ON CONFLICT: one statement per table, plus one per table removing result
+    rows the new copy of a segment no longer has. Re-sending a segment is idempotent.
+    Returns {batch_id: [summary_id, ...]} of the written segments.
+    """
+    # A segment sent twice in one chunk can only be written once per statement
+    unique = {}
+    for segment in segments:
+        unique[(segment['batch'], segment['date'], segment['time'])] = segment
+    segments = list(unique.values())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        batches = _create_batches({segment['batch'] for segment in segments})
+        for segment in segments:
+            segment['batch_pk'] = batches[segment['batch']]
+
+        summary_fields = VALUE_FIELDS['summary']
+        cursor.execute(
+            _upsert_sql(Summary, ['batch', 'date', 'time'], summary_fields, len(segments),
+                        returning=('id', 'batch_id', 'date', 'time')),
+            [value for segment in segments
+             for value in [segment['batch_pk'], segment['date'], segment['time']]
+             + [segment['summary'][field] for field in summary_fields]],
+        )
+        summary_ids = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+
+        written = {}
+        for segment in segments:
+            summary_id = summary_ids[(segment['batch_pk'], segment['date'], segment['time'])]
+            segment['summary_id'] = summary_id
+            written.setdefault(segment['batch_pk'], []).append(summary_id)
+
+        for key, model in CHILD_MODELS:
+            fields = VALUE_FIELDS[key]
+            # Prepared by the fields, which store results as codes, percentages as basis
+            # points and JSON adapted for the cursor
+            prepare = [model._meta.get_field(field).get_db_prep_save
+                       for field in ['overall_result'] + fields]
+            rows = [[segment['batch_pk'], segment['summary_id'], segment['date']]
+                    + [prep(value, connection) for prep, value in
+                       zip(prepare, [overall_result] + [values[field] for field in fields])]
+                    for segment in segments
+                    for overall_result, values in segment[key].items()]
+            if rows:
+                cursor.execute(
+                    _upsert_sql(model, ['batch', 'summary', 'date', 'overall_result'],
+                                fields, len(rows)),
+                    [value for row in rows for value in row],
+                )
+            kept = ['%s:%s' % (row[1], row[3]) for row in rows]
+            cursor.execute(
+                "DELETE FROM {0} WHERE summary_id = ANY(%s) "
+                "AND NOT (summary_id::text || ':' || overall_result = ANY(%s))"
+                .format(connection.ops.quote_name(model._meta.db_table)),
+                [[segment['summary_id'] for segment in segments], kept],
+            )
+
+        for batch_id in written:
+            counters.recount_batch(batch_id)
+    return written
+
+
+class SegmentWriter(object):
+    """
+    Single writer for parsed segments from any number of sources. Segments are buffered
+    and committed batch_size at a time; derived report data of the touched batches is
+    refreshed once, on close(). With upsert=True, segments already loaded are replaced
+    rather than duplicated.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, upsert=False):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.loaded = {}
+        self._buffer = []
+
+    def add(self, segments):
+        self._buffer.extend(segments)
+        while len(self._buffer) >= self.batch_size:
+            chunk = self._buffer[:self.batch_size]
+            self._buffer = self._buffer[self.batch_size:]
+            self._write(chunk)
+
+    def flush(self):
+        if self._buffer:
+            chunk, self._buffer = self._buffer, []
+            self._write(chunk)
+
+    def discard(self):
+        """
+        Drop buffered segments that weren't written, after a failed add().
+        """
+        self._buffer = []
+
+    def _write(self, chunk):
+        write_chunk = _upsert_chunk if self.upsert else _write_chunk
+        for batch_id, summary_ids in write_chunk(chunk).items():
+            self.loaded.setdefault(batch_id, []).extend(summary_ids)
+        # Only once the segments are committed, so the store never has parts of a
+        # segment the database doesn't
+        if rawstore.enabled():
+            rawstore.write_segments(chunk)
+
+    def close(self):
+        """
+        Write any buffered segments and refresh the touched batches.
+        Returns {batch_id: [summary_id, ...]} of every segment written.
+        """
+        self.flush()
+        for batch_id, summary_ids in self.loaded.items():
+            segments_changed(batch_id, summary_ids)
+        return self.loaded
+
+
+def load_segments(segments, batch_size=BATCH_SIZE, upsert=False):
+    """
+    Bulk load parsed segments (see csis.parse_rows), batch_size segments per transaction,
+    then refresh the derived report data of every touched batch once.
+    Returns {batch_id: [summary_id, ...]} of the loaded segments.
+    """
+    writer = SegmentWriter(batch_size, upsert)
+    writer.add(segments)
+    return writer.close()
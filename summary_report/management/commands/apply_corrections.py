@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from summary_report.signals import corrections_changed
+
+
+class Command(BaseCommand):
+    help = ('Re-apply the current MeasurementCorrection factors to the stored rollups of '
+            'every batch, e.g. after corrections were loaded outside the admin.')
+
+    def handle(self, *args, **options):
+        corrections_changed()
+        self.stdout.write('Re-applied corrections')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from summary_report.archive import ARCHIVE_AFTER_DAYS, archivable, archive_batch, restore_batch
+from summary_report.models import Batch
+
+
+class Command(BaseCommand):
+    help = ('Move the segments of closed batches out of the live tables into compressed '
+            'monthly archives (see summary_report/archive.py), or restore archived batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('batches', nargs='*', metavar='batch',
+                            help='Batches to archive (default: every batch closed for '
+                                 'longer than --days).')
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                            help='Archive batches unchanged for this many days '
+                                 '(default %d).' % ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--restore', action='store_true',
+                            help='Move the given batches back to the live tables.')
+
+    def handle(self, *args, **options):
+        if options['batches']:
+            batches = dict(Batch.objects
+                           .filter(batch_id__in=options['batches'])
+                           .values_list('pk', 'batch_id'))
+            missing = set(options['batches']) - set(batches.values())
+            if missing:
+                raise CommandError('Unknown batches: %s' % ', '.join(sorted(missing)))
+        elif options['restore']:
+            raise CommandError('Name the batches to restore')
+        else:
+            batches = dict(Batch.objects
+                           .filter(pk__in=list(archivable(options['days'])))
+                           .values_list('pk', 'batch_id'))
+
+        for batch_id, name in sorted(batches.items(), key=lambda item: item[1]):
+            if options['restore']:
+                self.stdout.write('Restored %s: %d segments' % (name, restore_batch(batch_id)))
+            else:
+                self.stdout.write('Archived %s: %d segments' % (name, archive_batch(batch_id)))
@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from summary_report.csis import parse_export
+from summary_report.ingest import BATCH_SIZE, SegmentWriter
+from summary_report.staging import StagingError, StagingWriter
+
+
+def export_paths(paths):
+    # Directories are expanded to the .csv files they contain
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith('.csv'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def _parse(path):
+    # Runs in the pool; errors are returned so one bad file doesn't stop the others
+    try:
+        return path, parse_export(path), None
+    except Exception as e:
+        return path, None, '%s: %s' % (type(e).__name__, e)
+
+
+def parsed_exports(paths, workers):
+    """
+    Yield (path, segments, error) for every export, parsing them across `workers`
+    processes in completion order. At most two files per worker are parsed or waiting to
+    be written at a time, so memory doesn't grow with the number of files.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield _parse(path)
+        return
+
+    # Forked workers mustn't share the parent's database connections
+    connections.close_all()
+    waiting = iter(paths)
+    running = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            running.update(pool.submit(_parse, path)
+                           for path in islice(waiting, workers * 2 - len(running)))
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class Command(BaseCommand):
+    help = 'Load CSIS result exports (see summary_report/csis.py for the file layout).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path',
+                            help='Export files, or directories of .csv exports.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Segments written per transaction (default %d).' % BATCH_SIZE)
+        parser.add_argument('--upsert', action='store_true',
+                            help='Replace segments already loaded (matched on batch, date '
+                                 'and time) instead of adding them again.')
+        parser.add_argument('--staged', action='store_true',
+                            help='Load into staging tables, validate, then publish everything '
+                                 'to the live tables in one transaction (implies --upsert).')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes parsing files in parallel (default 1).')
+
+    def _write_files(self, writer, files, failed):
+        """
+        Write parsed files in one transaction, as one chunk, or file by file in a savepoint
+        each when that fails, so only the files the database rejects are left out.
+        Returns the number of segments written.
+        """
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    writer.add([segment for path, segments in files for segment in segments])
+                    writer.flush()
+                return sum(len(segments) for path, segments in files)
+            except Exception:
+                writer.discard()
+
+            written = 0
+            for path, segments in files:
+                try:
+                    with transaction.atomic():
+                        writer.add(segments)
+                        writer.flush()
+                except Exception as e:
+                    writer.discard()
+                    failed.append(path)
+                    self.stderr.write('%s: %s: %s' % (path, type(e).__name__, e))
+                else:
+                    written += len(segments)
+            return written
+
+    def handle(self, *args, **options):
+        paths = list(export_paths(options['paths']))
+        if options['staged']:
+            writer = StagingWriter()
+        else:
+            writer = SegmentWriter(options['batch_size'], options['upsert'])
+        failed = []
+        segment_count = 0
+        # Parsed files waiting to be written together, batch_size segments at a time
+        pending = []
+
+        # Parsing fans out to the pool; this process is the only writer
+        for done, (path, segments, error) in enumerate(
+                parsed_exports(paths, options['workers']), 1):
+            if error:
+                failed.append(path)
+                self.stderr.write('[%d/%d] %s: %s' % (done, len(paths), path, error))
+                continue
+            self.stdout.write('[%d/%d] %s: %d segments' % (done, len(paths), path,
+                                                           len(segments)))
+            if options['staged']:
+                writer.add(segments)
+                segment_count += len(segments)
+                continue
+            pending.append((path, segments))
+            if sum(len(segments) for path, segments in pending) >= options['batch_size']:
+                segment_count += self._write_files(writer, pending, failed)
+                pending = []
+        if pending:
+            segment_count += self._write_files(writer, pending, failed)
+
+        try:
+            loaded = writer.close()
+        except StagingError as e:
+            raise CommandError('Nothing was published: %s' % e)
+        self.stdout.write(self.style.SUCCESS(
+            'Loaded %d segments into %d batches.' % (segment_count, len(loaded))))
+        if failed:
+            raise CommandError('%d of %d files failed: %s' % (len(failed), len(paths),
+                                                               ', '.join(failed)))
@@ -0,0 +1,33 @@
+import os
+import pickle
+from django.core.management.base import BaseCommand, CommandError
+from summary_report.buffer import SPOOL_DIR
+from summary_report.ingest import load_segments
+
+
+class Command(BaseCommand):
+    help = ('Load pushed segments that the ingest buffer failed to write and spooled to '
+            'CSIS_INGEST_SPOOL_DIR (see summary_report/buffer.py).')
+
+    def handle(self, *args, **options):
+        if not SPOOL_DIR:
+            raise CommandError('CSIS_INGEST_SPOOL_DIR is not set')
+        if not os.path.isdir(SPOOL_DIR):
+            return
+        failed = []
+        for name in sorted(os.listdir(SPOOL_DIR)):
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(SPOOL_DIR, name)
+            with open(path, 'rb') as spool_file:
+                segments = pickle.load(spool_file)
+            try:
+                load_segments(segments, upsert=True)
+            except Exception as e:
+                failed.append(path)
+                self.stderr.write('%s: %s: %s' % (path, type(e).__name__, e))
+                continue
+            os.remove(path)
+            self.stdout.write('%s: %d segments' % (path, len(segments)))
+        if failed:
+            raise CommandError('%d spooled files failed: %s' % (len(failed), ', '.join(failed)))
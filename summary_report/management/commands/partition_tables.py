@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from summary_report import partitions
+
+
+class Command(BaseCommand):
+    help = ('Partition the Summary and measurement tables by month (PostgreSQL 11+), for '
+            'databases migrated before the server supported it, create the upcoming '
+            'months\' partitions, and split loaded months out of the default partitions.')
+
+    def handle(self, *args, **options):
+        if not partitions.supported():
+            raise CommandError('Declarative partitioning needs PostgreSQL 11 or later')
+        for table in partitions.partition_tables():
+            self.stdout.write('Partitioned %s' % table)
+        partitions.ensure_upcoming()
+        for month in partitions.split_default():
+            self.stdout.write('Created the partitions of %04d-%02d' % (month.year, month.month))
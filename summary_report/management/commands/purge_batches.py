@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from summary_report.models import Batch
+from summary_report.purge import purge_batch
+
+
+class Command(BaseCommand):
+    help = ('Delete batches and all of their segments, measurements, rollups and archives '
+            'with set based statements, one transaction per batch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('batches', nargs='+', metavar='batch')
+
+    def handle(self, *args, **options):
+        batches = dict(Batch.objects
+                       .filter(batch_id__in=options['batches'])
+                       .values_list('batch_id', 'pk'))
+        missing = set(options['batches']) - set(batches)
+        if missing:
+            raise CommandError('Unknown batches: %s' % ', '.join(sorted(missing)))
+        for name in options['batches']:
+            deleted = purge_batch(batches[name])
+            self.stdout.write('Purged %s: %d rows' % (name, sum(deleted.values())))
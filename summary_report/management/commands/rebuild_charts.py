@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from summary_report.spc import CHART_METRICS, rebuild_charts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the control charts of every live batch from its segments, in timestamp order.'
+
+    def handle(self, *args, **options):
+        rebuild_charts()
+        self.stdout.write('Rebuilt %s' % ', '.join(CHART_METRICS))
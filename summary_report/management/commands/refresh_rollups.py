@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from summary_report.models import Batch
+from summary_report.rollups import refresh_batch
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stats report rollups of the given batches (default: all batches).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('batches', nargs='*', metavar='batch')
+
+    def handle(self, *args, **options):
+        batches = Batch.objects.all()
+        if options['batches']:
+            batches = batches.filter(batch_id__in=options['batches'])
+        for batch_id, name in batches.values_list('pk', 'batch_id'):
+            refresh_batch(batch_id)
+            self.stdout.write('Refreshed %s' % name)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from summary_report.aggregates import measurement_stats_sql, test_stats_sql
+from summary_report.models import Summary, StatsRollup, BatchMonth
+
+
+class Command(BaseCommand):
+    help = ('Print PostgreSQL query plans (with timings) of the report queries for a batch, '
+            'to check they use index scans rather than sequential scans.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch')
+        parser.add_argument('--no-analyze', action='store_false', dest='analyze',
+                            help='EXPLAIN only, without running the queries.')
+
+    def handle(self, *args, **options):
+        summary = (Summary.objects
+                   .filter(batch__batch_id=options['batch'])
+                   .order_by('date', 'time')
+                   .first())
+        if summary is None:
+            raise CommandError('Batch %s has no segments.' % options['batch'])
+        batch = summary.batch_id
+
+        queries = [
+            ('Stats means/counts (batch)', measurement_stats_sql(batch)),
+            ('Stats means/counts (segment, Good)',
+             measurement_stats_sql(batch, summary.pk, 'Good')),
+            ('Stats tests (batch)', test_stats_sql(batch)),
+            ('Stats tests (segment, Good)', test_stats_sql(batch, summary.pk, 'Good')),
+            ('Rollup lookup', StatsRollup.objects
+             .filter(batch_id=batch, summary__isnull=True, category='inspected')
+             .query.sql_with_params()),
+            ('Segment page', Summary.objects
+             .filter(batch_id=batch, date__gte=summary.date)
+             .order_by('date', 'time', 'pk')[:51]
+             .query.sql_with_params()),
+            ('Month archive', BatchMonth.objects
+             .filter(year=summary.date.year, month=summary.date.month)
+             .query.sql_with_params()),
+            ('Summary date range', Summary.objects
+             .filter(date__year=summary.date.year, date__month=summary.date.month)
+             .values('batch_id').distinct()
+             .query.sql_with_params()),
+        ]
+
+        explain = 'EXPLAIN (ANALYZE, BUFFERS) ' if options['analyze'] else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            for title, (sql, params) in queries:
+                cursor.execute(explain + sql, params)
+                self.stdout.write(self.style.MIGRATE_HEADING(title))
+                for row in cursor.fetchall():
+                    self.stdout.write('  ' + row[0])
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=15)),
+                ('count', models.IntegerField()),
+                ('means', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('counts', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('tests', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.Batch')),
+                ('summary', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='summary_report.Summary')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='statsrollup',
+            unique_together=set([('batch', 'summary', 'category')]),
+        ),
+    ]
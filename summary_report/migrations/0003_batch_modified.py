@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0002_statsrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='modified',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
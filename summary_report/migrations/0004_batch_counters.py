@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+COUNTER_FIELDS = ('inspected', 'good', 'fail_general', 'fail_od', 'fail_backward', 'n_a')
+
+
+def count_existing(apps, schema_editor):
+    Batch = apps.get_model('summary_report', 'Batch')
+    Summary = apps.get_model('summary_report', 'Summary')
+    totals = (Summary.objects
+              .values('batch_id')
+              .annotate(**{'total_' + field: Sum(field) for field in COUNTER_FIELDS}))
+    for row in totals:
+        Batch.objects.filter(pk=row['batch_id']).update(
+            **{field: row['total_' + field] for field in COUNTER_FIELDS})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0003_batch_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='inspected',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='good',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='fail_general',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='fail_od',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='fail_backward',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='n_a',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+import django.db.models.deletion
+
+
+def index_existing(apps, schema_editor):
+    BatchMonth = apps.get_model('summary_report', 'BatchMonth')
+    Summary = apps.get_model('summary_report', 'Summary')
+    months = (Summary.objects
+              .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+              .values('batch_id', 'year', 'month')
+              .annotate(segments=Count('id'), sensors=Sum('inspected')))
+    BatchMonth.objects.bulk_create(BatchMonth(**month) for month in months)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0004_batch_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.SmallIntegerField()),
+                ('month', models.SmallIntegerField()),
+                ('segments', models.IntegerField(default=0)),
+                ('sensors', models.IntegerField(default=0)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.Batch')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='batchmonth',
+            unique_together=set([('batch', 'year', 'month')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='batchmonth',
+            index_together=set([('year', 'month')]),
+        ),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+MEASUREMENT_TABLES = ('measurementcount', 'measurementmean', 'testpasspercent')
+
+
+def drop_duplicates(table):
+    # Rows written twice for a segment before these tables were unique: keep the latest.
+    # `manage.py refresh_rollups` rebuilds rollups that counted both.
+    return migrations.RunSQL(
+        'DELETE FROM summary_report_{0} a USING summary_report_{0} b '
+        'WHERE a.batch_id = b.batch_id AND a.summary_id = b.summary_id '
+        'AND a.overall_result = b.overall_result AND a.id < b.id'.format(table),
+        migrations.RunSQL.noop,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0005_batchmonth'),
+    ]
+
+    operations = [drop_duplicates(table) for table in MEASUREMENT_TABLES] + [
+        migrations.AlterUniqueTogether(
+            name='measurementcount',
+            unique_together=set([('batch', 'summary', 'overall_result')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='measurementmean',
+            unique_together=set([('batch', 'summary', 'overall_result')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='testpasspercent',
+            unique_together=set([('batch', 'summary', 'overall_result')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='summary',
+            index_together=set([('batch', 'date', 'time')]),
+        ),
+        # Date range scans over the whole table (archive queries, date filters). Rows are
+        # inserted in date order, so a BRIN index stays tiny.
+        migrations.RunSQL(
+            'CREATE INDEX summary_report_summary_date_brin '
+            'ON summary_report_summary USING brin (date)',
+            'DROP INDEX summary_report_summary_date_brin',
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+COUNTER_FIELDS = ('inspected', 'good', 'fail_general', 'fail_od', 'fail_backward', 'n_a')
+
+
+def drop_duplicate_segments(apps, schema_editor):
+    # Segments re-sent before the constraint existed: keep the latest copy of each
+    Batch = apps.get_model('summary_report', 'Batch')
+    BatchMonth = apps.get_model('summary_report', 'BatchMonth')
+    Summary = apps.get_model('summary_report', 'Summary')
+    duplicates = (Summary.objects
+                  .values('batch_id', 'date', 'time')
+                  .annotate(copies=Count('id'), latest=Max('id'))
+                  .filter(copies__gt=1))
+    batch_ids = set()
+    for duplicate in duplicates:
+        (Summary.objects
+         .filter(batch_id=duplicate['batch_id'], date=duplicate['date'], time=duplicate['time'])
+         .exclude(pk=duplicate['latest'])
+         .delete())
+        batch_ids.add(duplicate['batch_id'])
+
+    # Recount the batches' counters and calendar index (see counters.recount_batch)
+    for batch_id in batch_ids:
+        summaries = Summary.objects.filter(batch_id=batch_id)
+        totals = summaries.aggregate(**{field: Sum(field) for field in COUNTER_FIELDS})
+        Batch.objects.filter(pk=batch_id).update(
+            **{field: totals[field] or 0 for field in COUNTER_FIELDS})
+        months = (summaries
+                  .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+                  .values('year', 'month')
+                  .annotate(segments=Count('id'), sensors=Sum('inspected')))
+        BatchMonth.objects.filter(batch_id=batch_id).delete()
+        BatchMonth.objects.bulk_create(BatchMonth(batch_id=batch_id, **month)
+                                       for month in months)
+
+    # The deletes leave deferred foreign key checks pending, which would block altering
+    # the table below in the same transaction
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0006_report_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_segments, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='summary',
+            unique_together=set([('batch', 'date', 'time')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='summary',
+            index_together=set([]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0007_summary_natural_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('overall_result', models.CharField(max_length=63)),
+                ('sketches', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.Batch')),
+                ('summary', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.Summary')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='measurementsketch',
+            unique_together=set([('batch', 'summary', 'overall_result')]),
+        ),
+    ]
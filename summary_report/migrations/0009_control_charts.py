@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0008_measurementsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControlChart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=63, unique=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('points', models.IntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('squares', models.FloatField(default=0)),
+                ('moving_ranges', models.FloatField(default=0)),
+                ('last_value', models.FloatField(null=True)),
+                ('ewma', models.FloatField(null=True)),
+                ('cusum_high', models.FloatField(default=0)),
+                ('cusum_low', models.FloatField(default=0)),
+                ('last_date', models.DateField(null=True)),
+                ('last_time', models.TimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ControlPoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.FloatField()),
+                ('ewma', models.FloatField()),
+                ('cusum_high', models.FloatField()),
+                ('cusum_low', models.FloatField()),
+                ('chart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.ControlChart')),
+                ('summary', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.Summary')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='controlpoint',
+            unique_together=set([('chart', 'summary')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0009_control_charts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statsrollup',
+            name='factors',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+CHILD_MODELS = ('testpasspercent', 'measurementmean', 'measurementcount', 'measurementsketch')
+
+
+def partition(apps, schema_editor):
+    # Skipped on servers before PostgreSQL 11; `manage.py partition_tables` converts the
+    # tables after an upgrade.
+    from summary_report.partitions import partition_tables
+    partition_tables(schema_editor.connection)
+
+
+def summary_fk(**kwargs):
+    return models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE,
+                             to='summary_report.Summary', **kwargs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0010_statsrollup_factors'),
+    ]
+
+    operations = [
+        migrations.AlterField(model_name='statsrollup', name='summary',
+                              field=summary_fk(null=True)),
+        migrations.AlterField(model_name='controlpoint', name='summary', field=summary_fk()),
+    ] + [
+        operation for model_name in CHILD_MODELS for operation in (
+            migrations.AlterField(model_name=model_name, name='summary', field=summary_fk()),
+            migrations.AddField(model_name=model_name, name='date',
+                                field=models.DateField(editable=False, null=True)),
+            migrations.RunSQL(
+                'UPDATE summary_report_{0} c SET date = s.date FROM summary_report_summary s '
+                'WHERE s.id = c.summary_id'.format(model_name),
+                migrations.RunSQL.noop,
+            ),
+            migrations.AlterField(model_name=model_name, name='date',
+                                  field=models.DateField(editable=False)),
+            migrations.AlterUniqueTogether(
+                name=model_name,
+                unique_together=set([('batch', 'summary', 'overall_result', 'date')]),
+            ),
+        )
+    ] + [
+        migrations.RunPython(partition),
+    ]
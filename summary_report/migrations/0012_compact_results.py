@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import summary_report.fields
+
+RESULT_TABLES = ('testpasspercent', 'measurementmean', 'measurementcount', 'measurementsketch')
+
+TEST_FIELDS = (
+    'round_end',
+    'flat_end',
+    'outer_dimension',
+    'sepia_screen',
+    'round_valid_master',
+    'round_valid',
+    'round_present',
+    'round_orientation',
+    'round_inner_bright',
+    'round_outer_bright',
+    'round_inner_small_dark',
+    'round_outer_small_dark',
+    'round_inner_large_dark',
+    'round_outer_large_dark',
+    'flat_valid_master',
+    'flat_orientation',
+    'flat_valid',
+    'flat_ID',
+    'flat_obstruction',
+    'flat_chip',
+    'dimension_position',
+    'dimension_length',
+    'dimension_bumps',
+    'dimension_chips',
+    'dimension_envelope',
+    'dimension_nose',
+    'sepia_valid',
+    'sepia_bright_spot',
+    'sepia_blemish',
+    'sepia_spot_crack',
+)
+
+
+def result_sql(table):
+    # overall_result names replaced by their OverallResult ids
+    return [
+        'ALTER TABLE summary_report_{0} ADD COLUMN result_code smallint',
+        'UPDATE summary_report_{0} t SET result_code = r.id '
+        'FROM summary_report_overallresult r WHERE r.name = t.overall_result',
+        'ALTER TABLE summary_report_{0} DROP COLUMN overall_result',
+        'ALTER TABLE summary_report_{0} RENAME COLUMN result_code TO overall_result',
+        'ALTER TABLE summary_report_{0} ALTER COLUMN overall_result SET NOT NULL',
+        'ALTER TABLE summary_report_{0} ADD CONSTRAINT summary_report_{0}_uniq '
+        'UNIQUE (batch_id, summary_id, overall_result, date)',
+    ], [
+        'ALTER TABLE summary_report_{0} ADD COLUMN result_name varchar(63)',
+        'UPDATE summary_report_{0} t SET result_name = r.name '
+        'FROM summary_report_overallresult r WHERE r.id = t.overall_result',
+        'ALTER TABLE summary_report_{0} DROP COLUMN overall_result',
+        'ALTER TABLE summary_report_{0} RENAME COLUMN result_name TO overall_result',
+        'ALTER TABLE summary_report_{0} ALTER COLUMN overall_result SET NOT NULL',
+        'ALTER TABLE summary_report_{0} ADD CONSTRAINT summary_report_{0}_uniq '
+        'UNIQUE (batch_id, summary_id, overall_result, date)',
+    ]
+
+
+def result_operation(table):
+    forwards, backwards = result_sql(table)
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[migrations.RunSQL([sql.format(table) for sql in forwards],
+                                               [sql.format(table) for sql in backwards])],
+        state_operations=[migrations.AlterField(model_name=table, name='overall_result',
+                                                field=summary_report.fields.ResultField())],
+    )
+
+
+# Pass percentages to basis points, in one rewrite of the table (flat_ID needs quoting)
+percent_operation = migrations.SeparateDatabaseAndState(
+    database_operations=[migrations.RunSQL(
+        'ALTER TABLE summary_report_testpasspercent ' + ', '.join(
+            'ALTER COLUMN "{0}" TYPE smallint USING round("{0}" * 100)::smallint'.format(field)
+            for field in TEST_FIELDS),
+        'ALTER TABLE summary_report_testpasspercent ' + ', '.join(
+            'ALTER COLUMN "{0}" TYPE numeric(5, 2) USING "{0}" / 100.0'.format(field)
+            for field in TEST_FIELDS),
+    )],
+    state_operations=[migrations.AlterField(model_name='testpasspercent', name=field,
+                                            field=summary_report.fields.BasisPointsField())
+                      for field in TEST_FIELDS],
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0011_partition_by_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverallResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=63, unique=True)),
+            ],
+        ),
+        migrations.RunSQL(
+            'INSERT INTO summary_report_overallresult (name) SELECT overall_result FROM ('
+            + ' UNION '.join('SELECT overall_result FROM summary_report_%s' % table
+                             for table in RESULT_TABLES)
+            + ') results ORDER BY overall_result',
+            migrations.RunSQL.noop,
+        ),
+    ] + [result_operation(table) for table in RESULT_TABLES] + [percent_operation]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Tables referencing Batch, whose batch_id columns change from the batch name to its key
+BATCH_TABLES = ('summary', 'batchmonth', 'statsrollup', 'testpasspercent', 'measurementmean',
+                'measurementcount', 'measurementsketch')
+
+
+def batch_key(apps, schema_editor):
+    # Columns are converted in place, so their indexes and unique constraints are kept
+    # (rebuilt over the integers), partitioned tables included.
+    from summary_report.partitions import supported
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        # Deferred checks of earlier migrations would block altering the tables
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        # Foreign keys to the batch_id primary key; those of partitions go with their table's
+        cursor.execute("SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                       "WHERE contype = 'f' AND confrelid = 'summary_report_batch'::regclass"
+                       + (' AND conparentid = 0' if supported(connection) else ''))
+        for table, constraint in cursor.fetchall():
+            cursor.execute('ALTER TABLE {0} DROP CONSTRAINT {1}'.format(table, quote(constraint)))
+        cursor.execute("SELECT conname FROM pg_constraint "
+                       "WHERE contype = 'p' AND conrelid = 'summary_report_batch'::regclass")
+        cursor.execute('ALTER TABLE summary_report_batch DROP CONSTRAINT {0}'
+                       .format(quote(cursor.fetchone()[0])))
+        cursor.execute('ALTER TABLE summary_report_batch ADD COLUMN id serial PRIMARY KEY')
+        cursor.execute('ALTER TABLE summary_report_batch '
+                       'ADD CONSTRAINT summary_report_batch_batch_id_key UNIQUE (batch_id)')
+
+        cursor.execute("CREATE FUNCTION pg_temp.batch_key(varchar) RETURNS integer AS "
+                       "'SELECT id FROM summary_report_batch WHERE batch_id = $1' "
+                       "LANGUAGE sql STABLE")
+        for name in BATCH_TABLES:
+            table = 'summary_report_' + name
+            # Pattern indexes Django adds to varchar foreign keys don't apply to integers
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s "
+                           "AND indexdef LIKE %s", [table, '%(batch_id varchar_pattern_ops)%'])
+            for index, in cursor.fetchall():
+                cursor.execute('DROP INDEX {0}'.format(quote(index)))
+            cursor.execute('ALTER TABLE {0} ALTER COLUMN batch_id TYPE integer '
+                           'USING pg_temp.batch_key(batch_id)'.format(table))
+            cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} FOREIGN KEY (batch_id) '
+                           'REFERENCES summary_report_batch (id) DEFERRABLE INITIALLY DEFERRED'
+                           .format(table, quote(table + '_batch_fk')))
+        cursor.execute('DROP FUNCTION pg_temp.batch_key(varchar)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0012_compact_results'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(batch_key)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='batch',
+                    name='batch_id',
+                    field=models.CharField(max_length=31, unique=True),
+                ),
+                migrations.AddField(
+                    model_name='batch',
+                    name='id',
+                    field=models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+                    preserve_default=False,
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0013_batch_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='archived',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.SmallIntegerField()),
+                ('month', models.SmallIntegerField()),
+                ('segments', models.IntegerField()),
+                ('summaries', models.BinaryField()),
+                ('measurements', models.BinaryField()),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='summary_report.Batch')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedmonth',
+            unique_together=set([('batch', 'year', 'month')]),
+        ),
+    ]
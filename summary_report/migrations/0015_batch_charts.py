@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Charts move from one series over every batch to one per batch. The old points are
+    # dropped; `manage.py rebuild_charts` charts the live batches again.
+
+    dependencies = [
+        ('summary_report', '0014_archive'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'DELETE FROM summary_report_controlpoint; DELETE FROM summary_report_controlchart',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddField(
+            model_name='controlchart',
+            name='batch',
+            field=models.ForeignKey(default=0, on_delete=django.db.models.deletion.CASCADE, to='summary_report.Batch'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='controlchart',
+            name='metric',
+            field=models.CharField(max_length=63),
+        ),
+        migrations.AlterUniqueTogether(
+            name='controlchart',
+            unique_together=set([('batch', 'metric')]),
+        ),
+        migrations.AddField(
+            model_name='controlpoint',
+            name='number',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='controlpoint',
+            name='mean',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='controlpoint',
+            name='squares',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='controlpoint',
+            name='moving_ranges',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='controlpoint',
+            name='summary',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='summary_report.Summary'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='controlpoint',
+            unique_together=set([('chart', 'summary'), ('chart', 'number')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summary_report', '0015_batch_charts'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='summary',
+            index_together=set([('batch', 'date', 'time', 'id')]),
+        ),
+    ]
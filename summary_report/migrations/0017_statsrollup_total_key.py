@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # unique_together doesn't cover batch totals, whose summary is NULL: one total per batch
+    # and category, keeping the latest of any written twice by concurrent refreshes.
+
+    dependencies = [
+        ('summary_report', '0016_summary_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'DELETE FROM summary_report_statsrollup a USING summary_report_statsrollup b '
+            'WHERE a.summary_id IS NULL AND b.summary_id IS NULL '
+            'AND a.batch_id = b.batch_id AND a.category = b.category AND a.id < b.id',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX summary_report_statsrollup_total_key '
+            'ON summary_report_statsrollup (batch_id, category) WHERE summary_id IS NULL',
+            'DROP INDEX summary_report_statsrollup_total_key',
+        ),
+    ]
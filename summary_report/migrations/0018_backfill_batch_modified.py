@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Batches from before 0003 have no `modified`, so the api sent them without a
+    # Last-Modified or ETag. Backfill it from the batch's latest segment, falling back to
+    # when it was archived, then to now.
+
+    dependencies = [
+        ('summary_report', '0017_statsrollup_total_key'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'UPDATE summary_report_batch b SET modified = COALESCE('
+            '(SELECT MAX(s.date + s.time) FROM summary_report_summary s WHERE s.batch_id = b.id), '
+            'b.archived, now()) '
+            'WHERE b.modified IS NULL',
+            migrations.RunSQL.noop,
+        ),
+    ]
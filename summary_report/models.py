@@ -1,9 +1,23 @@
 from django.db import models
 from django.db.migrations.operations import RenameField
+from django.contrib.postgres.fields import JSONField
+from .fields import BasisPointsField, ResultField
 
 
 class Batch(models.Model):
-    batch_id = models.CharField(max_length=31, primary_key=True, unique=True)
+    # Rows reference batches by the integer id; batch_id is the name used in urls
+    batch_id = models.CharField(max_length=31, unique=True)
+    # Last time any of the batch's report data changed, for conditional responses
+    modified = models.DateTimeField(null=True, editable=False)
+    # Running totals of the batch's Summary counts, see counters.py
+    inspected = models.IntegerField(default=0, editable=False)
+    good = models.IntegerField(default=0, editable=False)
+    fail_general = models.IntegerField(default=0, editable=False)
+    fail_od = models.IntegerField(default=0, editable=False)
+    fail_backward = models.IntegerField(default=0, editable=False)
+    n_a = models.IntegerField(default=0, editable=False)
+    # When the batch's segments were moved to ArchivedMonth rows, see archive.py
+    archived = models.DateTimeField(null=True, editable=False)
 
     def __str__(self):
         return self.batch_id
@@ -13,7 +27,7 @@ class Batch(models.Model):
 
 
 class Summary(models.Model):
-    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE, to_field='batch_id')
+    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
     date = models.DateField()
     time = models.TimeField()
     inspected = models.IntegerField()
@@ -32,45 +46,97 @@ class Summary(models.Model):
 
     class Meta:
         verbose_name_plural = 'summaries'
+        # A segment is identified by its batch and timestamp; re-sent segments are upserted
+        unique_together = ('batch', 'date', 'time')
+        # Keyset pages of a batch's segments, see views.segment_page
+        index_together = ('batch', 'date', 'time', 'id')
 
     def __str__(self):
         return str(self.date) + ' - ' + str(self.time)
 
 
+class BatchMonth(models.Model):
+    # Calendar index of the archive pages: the batches run in each month, with the
+    # month's segment and sensor counts. Maintained with the Batch counters.
+    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
+    year = models.SmallIntegerField()
+    month = models.SmallIntegerField()
+    segments = models.IntegerField(default=0)
+    sensors = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('batch', 'year', 'month')
+        index_together = ('year', 'month')
+
+    def __str__(self):
+        return '%s - %d/%02d' % (self.batch, self.year, self.month)
+
+
+class ArchivedMonth(models.Model):
+    # A month of an archived batch's Summary and measurement rows, as compressed JSON. The
+    # batch's rollups, counters and calendar entries stay in their tables.
+    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
+    year = models.SmallIntegerField()
+    month = models.SmallIntegerField()
+    segments = models.IntegerField()
+    summaries = models.BinaryField()
+    measurements = models.BinaryField()
+
+    class Meta:
+        unique_together = ('batch', 'year', 'month')
+
+    def __str__(self):
+        return '%s - %d/%02d' % (self.batch, self.year, self.month)
+
+
+class OverallResult(models.Model):
+    # Lookup of the overall_result names stored as codes in the measurement tables
+    name = models.CharField(max_length=63, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
 class TestPassPercent(models.Model):
     batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
-    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE)
-    overall_result = models.CharField(max_length=63)
-    round_end = models.DecimalField(max_digits=5, decimal_places=2) # re_station
-    flat_end = models.DecimalField(max_digits=5, decimal_places=2) # fe_station
-    outer_dimension = models.DecimalField(max_digits=5, decimal_places=2) # odp_station
-    sepia_screen = models.DecimalField(max_digits=5, decimal_places=2) # ss_station
-    round_valid_master = models.DecimalField(max_digits=5, decimal_places=2) # re_valid_master
-    round_valid = models.DecimalField(max_digits=5, decimal_places=2) # re_valid
-    round_present = models.DecimalField(max_digits=5, decimal_places=2) # re_present
-    round_orientation = models.DecimalField(max_digits=5, decimal_places=2) # re_orientation
-    round_inner_bright = models.DecimalField(max_digits=5, decimal_places=2) # re_inner_bright
-    round_outer_bright = models.DecimalField(max_digits=5, decimal_places=2) # re_outer_bright
-    round_inner_small_dark = models.DecimalField(max_digits=5, decimal_places=2) # re_inner_small_dark
-    round_outer_small_dark = models.DecimalField(max_digits=5, decimal_places=2) # re_outer_small_dark
-    round_inner_large_dark = models.DecimalField(max_digits=5, decimal_places=2) # re_inner_large_dark
-    round_outer_large_dark = models.DecimalField(max_digits=5, decimal_places=2) # re_outer_large_dark
-    flat_valid_master = models.DecimalField(max_digits=5, decimal_places=2) # fe_valid_master
-    flat_orientation = models.DecimalField(max_digits=5, decimal_places=2) # fe_orientation
-    flat_valid = models.DecimalField(max_digits=5, decimal_places=2) # fe_valid
-    flat_ID = models.DecimalField(max_digits=5, decimal_places=2) # fe_inner_diameter
-    flat_obstruction = models.DecimalField(max_digits=5, decimal_places=2) # fe_obstruction
-    flat_chip = models.DecimalField(max_digits=5, decimal_places=2) # fe_chip
-    dimension_position = models.DecimalField(max_digits=5, decimal_places=2) # odp_position
-    dimension_length = models.DecimalField(max_digits=5, decimal_places=2) # odp_length
-    dimension_bumps = models.DecimalField(max_digits=5, decimal_places=2) # odp_bumps
-    dimension_chips = models.DecimalField(max_digits=5, decimal_places=2) # odp_chips
-    dimension_envelope = models.DecimalField(max_digits=5, decimal_places=2) # odp_envelope
-    dimension_nose = models.DecimalField(max_digits=5, decimal_places=2) # odp_nose
-    sepia_valid = models.DecimalField(max_digits=5, decimal_places=2) # ss_valid
-    sepia_bright_spot = models.DecimalField(max_digits=5, decimal_places=2) # ss_bright_defect
-    sepia_blemish = models.DecimalField(max_digits=5, decimal_places=2) # ss_blemish_defect
-    sepia_spot_crack = models.DecimalField(max_digits=5, decimal_places=2) # ss_spot_crack_defect
+    # Summary is partitioned, see partitions.py
+    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE, db_constraint=False)
+    overall_result = ResultField()
+    # The Summary date, this table's partition key
+    date = models.DateField(editable=False)
+    round_end = BasisPointsField() # re_station
+    flat_end = BasisPointsField() # fe_station
+    outer_dimension = BasisPointsField() # odp_station
+    sepia_screen = BasisPointsField() # ss_station
+    round_valid_master = BasisPointsField() # re_valid_master
+    round_valid = BasisPointsField() # re_valid
+    round_present = BasisPointsField() # re_present
+    round_orientation = BasisPointsField() # re_orientation
+    round_inner_bright = BasisPointsField() # re_inner_bright
+    round_outer_bright = BasisPointsField() # re_outer_bright
+    round_inner_small_dark = BasisPointsField() # re_inner_small_dark
+    round_outer_small_dark = BasisPointsField() # re_outer_small_dark
+    round_inner_large_dark = BasisPointsField() # re_inner_large_dark
+    round_outer_large_dark = BasisPointsField() # re_outer_large_dark
+    flat_valid_master = BasisPointsField() # fe_valid_master
+    flat_orientation = BasisPointsField() # fe_orientation
+    flat_valid = BasisPointsField() # fe_valid
+    flat_ID = BasisPointsField() # fe_inner_diameter
+    flat_obstruction = BasisPointsField() # fe_obstruction
+    flat_chip = BasisPointsField() # fe_chip
+    dimension_position = BasisPointsField() # odp_position
+    dimension_length = BasisPointsField() # odp_length
+    dimension_bumps = BasisPointsField() # odp_bumps
+    dimension_chips = BasisPointsField() # odp_chips
+    dimension_envelope = BasisPointsField() # odp_envelope
+    dimension_nose = BasisPointsField() # odp_nose
+    sepia_valid = BasisPointsField() # ss_valid
+    sepia_bright_spot = BasisPointsField() # ss_bright_defect
+    sepia_blemish = BasisPointsField() # ss_blemish_defect
+    sepia_spot_crack = BasisPointsField() # ss_spot_crack_defect
+
+    class Meta:
+        unique_together = ('batch', 'summary', 'overall_result', 'date')
 
     def __str__(self):
         return str(self.summary) + ' - ' + str(self.overall_result)
@@ -78,8 +144,11 @@ class TestPassPercent(models.Model):
 
 class MeasurementMean(models.Model):
     batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
-    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE)
-    overall_result = models.CharField(max_length=63)
+    # Summary is partitioned, see partitions.py
+    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE, db_constraint=False)
+    overall_result = ResultField()
+    # The Summary date, this table's partition key
+    date = models.DateField(editable=False)
     round_inner_bright_area = models.FloatField() # re_ida_bright
     round_inner_large_dark_area = models.FloatField() # re_ida_large_dark
     round_inner_small_dark_area = models.FloatField() # re_ida_small_dark
@@ -100,16 +169,22 @@ class MeasurementMean(models.Model):
     sepia_blemish_area = models.FloatField() # ss_blemish_da_mm2
     sepia_spot_crack_area = models.FloatField() # ss_spot_crack_da_mm2
 
+    class Meta:
+        unique_together = ('batch', 'summary', 'overall_result', 'date')
+
     def __str__(self):
-        return (str(self.batch_id) + ' - '
+        return (str(self.batch) + ' - '
                 + str(self.summary) + ' - '
                 + str(self.overall_result))
 
 
 class MeasurementCount(models.Model):
     batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
-    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE)
-    overall_result = models.CharField(max_length=63)
+    # Summary is partitioned, see partitions.py
+    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE, db_constraint=False)
+    overall_result = ResultField()
+    # The Summary date, this table's partition key
+    date = models.DateField(editable=False)
     round_inner_bright_area = models.IntegerField()  # re_ida_bright
     round_inner_large_dark_area = models.IntegerField()  # re_ida_large_dark
     round_inner_small_dark_area = models.IntegerField()  # re_ida_small_dark
@@ -130,8 +205,31 @@ class MeasurementCount(models.Model):
     sepia_blemish_area = models.IntegerField()  # ss_blemish_da_mm2
     sepia_spot_crack_area = models.IntegerField()  # ss_spot_crack_da_mm2
 
+    class Meta:
+        unique_together = ('batch', 'summary', 'overall_result', 'date')
+
+    def __str__(self):
+        return (str(self.batch) + ' - '
+                + str(self.summary) + ' - '
+                + str(self.overall_result))
+
+
+class MeasurementSketch(models.Model):
+    # Quantile sketches of the parts behind the MeasurementMean row with the same keys,
+    # {field: sketch}, see sketches.py. Only segments loaded with part records have them.
+    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
+    # Summary is partitioned, see partitions.py
+    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE, db_constraint=False)
+    overall_result = ResultField()
+    # The Summary date, this table's partition key
+    date = models.DateField(editable=False)
+    sketches = JSONField()
+
+    class Meta:
+        unique_together = ('batch', 'summary', 'overall_result', 'date')
+
     def __str__(self):
-        return (str(self.batch_id) + ' - '
+        return (str(self.batch) + ' - '
                 + str(self.summary) + ' - '
                 + str(self.overall_result))
 
@@ -159,4 +257,79 @@ class MeasurementCorrection(models.Model):
     correction_factor = models.FloatField()
 
     def __str__(self):
-        return self.measurement
\ No newline at end of file
+        return self.measurement
+
+
+class StatsRollup(models.Model):
+    # Finished stats report for one category of a segment (or of the whole batch when
+    # summary is null). Rebuilt from the measurement tables by rollups.py. Means are
+    # corrected, by the factors recorded in factors, see corrections.py.
+    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
+    summary = models.ForeignKey(to=Summary, on_delete=models.CASCADE, null=True,
+                                db_constraint=False)
+    category = models.CharField(max_length=15)
+    count = models.IntegerField()
+    means = JSONField()
+    counts = JSONField()
+    tests = JSONField()
+    factors = JSONField(default=dict)
+
+    class Meta:
+        # Batch totals (summary null) have a partial unique index of their own, see
+        # migration 0017
+        unique_together = ('batch', 'summary', 'category')
+
+    def __str__(self):
+        return (str(self.batch) + ' - '
+                + str(self.summary or 'Job Total') + ' - '
+                + self.category)
+
+
+class ControlChart(models.Model):
+    # Running state of a control chart over a batch's segments, updated as segments are
+    # added, see spc.py. Center and sigma are estimated from the points so far.
+    batch = models.ForeignKey(to=Batch, on_delete=models.CASCADE)
+    metric = models.CharField(max_length=63)
+    modified = models.DateTimeField(auto_now=True)
+    points = models.IntegerField(default=0)
+    mean = models.FloatField(default=0)
+    # Sum of squared deviations from the mean (Welford)
+    squares = models.FloatField(default=0)
+    # Sum of the moving ranges between consecutive points
+    moving_ranges = models.FloatField(default=0)
+    last_value = models.FloatField(null=True)
+    ewma = models.FloatField(null=True)
+    cusum_high = models.FloatField(default=0)
+    cusum_low = models.FloatField(default=0)
+    last_date = models.DateField(null=True)
+    last_time = models.TimeField(null=True)
+
+    class Meta:
+        unique_together = ('batch', 'metric')
+
+    def __str__(self):
+        return str(self.batch) + ' - ' + self.metric
+
+
+class ControlPoint(models.Model):
+    # One segment's point on a control chart, with the chart's running state after it, so
+    # the chart can be recomputed from any point on. Points of deleted segments stay until
+    # the chart is recomputed without them.
+    chart = models.ForeignKey(to=ControlChart, on_delete=models.CASCADE)
+    summary = models.ForeignKey(to=Summary, on_delete=models.DO_NOTHING, db_constraint=False)
+    # Position on the chart, from 1
+    number = models.IntegerField()
+    value = models.FloatField()
+    mean = models.FloatField()
+    squares = models.FloatField()
+    moving_ranges = models.FloatField()
+    ewma = models.FloatField()
+    cusum_high = models.FloatField()
+    cusum_low = models.FloatField()
+
+    class Meta:
+        unique_together = (('chart', 'summary'), ('chart', 'number'))
+
+    def __str__(self):
+        return str(self.chart) + ' - ' + str(self.summary)
+
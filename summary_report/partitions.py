@@ -0,0 +1,219 @@
+from datetime import date
+from django.conf import settings
+from django.db import connection, transaction
+
+# Summary and its child tables are range partitioned by month of the Summary date
+# (PostgreSQL 11+ declarative partitioning), so date range queries and vacuum touch only the
+# months they need. Each table has a <table>_pYYYYMM partition per month and a
+# <table>_default partition that takes rows of months without one; creating a month's
+# partition moves its rows out of the default. Creating a partition locks the whole table,
+# so it's only done by maintenance, each table in a short transaction of its own: upcoming
+# months after every migrate and by `manage.py partition_tables`, which also splits the
+# months that loads put into the default partitions. Loads never create partitions.
+#
+# Partitioned tables can't have a unique key without the partition key, so their primary
+# keys are (id, date) and nothing references Summary.id with a database constraint; the
+# ORM still cascades deletes. Partitioning keeps a table's indexes and constraints under
+# their names, with date added to its unique keys.
+
+MIN_SERVER_VERSION = 110000
+MONTHS_AHEAD = getattr(settings, 'CSIS_PARTITION_MONTHS_AHEAD', 3)
+
+BATCH_TABLE = 'summary_report_batch'
+
+PARTITIONED_TABLES = (
+    'summary_report_summary',
+    'summary_report_testpasspercent',
+    'summary_report_measurementmean',
+    'summary_report_measurementcount',
+    'summary_report_measurementsketch',
+)
+
+# Months known to have partitions, in this process
+_months = set()
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def supported(conn=connection):
+    return conn.vendor == 'postgresql' and conn.pg_version >= MIN_SERVER_VERSION
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return '%s_p%04d%02d' % (table, month.year, month.month)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def _create_partition(cursor, table, month):
+    name = partition_name(table, month)
+    cursor.execute('SELECT to_regclass(%s)', [name])
+    if cursor.fetchone()[0] is not None:
+        return
+    bounds = [month, next_month(month)]
+    default = table + '_default'
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM {0} WHERE date >= %s AND date < %s)'
+                   .format(_quote(default)), bounds)
+    moving = cursor.fetchone()[0]
+    # The default can't hold rows of a new partition's range while it's attached
+    if moving:
+        cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(_quote(table),
+                                                                     _quote(default)))
+    cursor.execute('CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM (%s) TO (%s)'
+                   .format(_quote(name), _quote(table)), bounds)
+    if moving:
+        cursor.execute('INSERT INTO {0} SELECT * FROM {1} WHERE date >= %s AND date < %s'
+                       .format(_quote(name), _quote(default)), bounds)
+        cursor.execute('DELETE FROM {0} WHERE date >= %s AND date < %s'
+                       .format(_quote(default)), bounds)
+        cursor.execute('ALTER TABLE {0} ATTACH PARTITION {1} DEFAULT'
+                       .format(_quote(table), _quote(default)))
+
+
+def ensure_months(days):
+    """
+    Create the partitions of the months of the given dates that don't have them yet, in
+    every partitioned table, one table per transaction. Does nothing where the tables
+    aren't partitioned.
+    """
+    months = {month_start(day) for day in days} - _months
+    if not months:
+        return
+    if supported():
+        for table in PARTITIONED_TABLES:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if is_partitioned(cursor, table):
+                    for month in sorted(months):
+                        _create_partition(cursor, table, month)
+    _months.update(months)
+
+
+def ensure_upcoming(months_ahead=MONTHS_AHEAD):
+    """
+    Create the partitions of this month and the next months_ahead months.
+    """
+    month = month_start(date.today())
+    months = []
+    for i in range(months_ahead + 1):
+        months.append(month)
+        month = next_month(month)
+    ensure_months(months)
+
+
+def _constraints(cursor, table):
+    # [(name, type, definition, columns)] of a table's primary, unique and foreign keys
+    cursor.execute(
+        'SELECT c.conname, c.contype, pg_get_constraintdef(c.oid), '
+        'ARRAY(SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY k(attnum, position) '
+        'JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum '
+        'ORDER BY k.position) '
+        "FROM pg_constraint c WHERE c.conrelid = to_regclass(%s) AND c.contype IN ('p', 'u', 'f')",
+        [table])
+    return cursor.fetchall()
+
+
+def _indexes(cursor, table):
+    # CREATE INDEX statements of a table's indexes other than its constraints'
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() '
+        'AND tablename = %s AND indexname NOT IN ('
+        'SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))',
+        [table, table])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def split_default():
+    """
+    Create the partitions of the months whose rows are in the default partitions.
+    Returns the months created.
+    """
+    if not supported():
+        return []
+    months = set()
+    with connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(cursor, table):
+                cursor.execute("SELECT DISTINCT date_trunc('month', date)::date FROM {0}"
+                               .format(_quote(table + '_default')))
+                months.update(row[0] for row in cursor.fetchall())
+    _months.difference_update(months)
+    ensure_months(months)
+    return sorted(months)
+
+
+def partition_table(cursor, table, months_ahead=MONTHS_AHEAD):
+    """
+    Replace a table with a partitioned copy holding the same rows, with a partition for
+    every month from its first row to months_ahead months from now. The table's indexes
+    and keys are recreated under their names once the old table is gone; date is added to
+    keys that lack it.
+    """
+    old = table + '_unpartitioned'
+    names = {'table': _quote(table), 'old': _quote(old)}
+    constraints, indexes = _constraints(cursor, table), _indexes(cursor, table)
+
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+    sequence = cursor.fetchone()[0]
+    cursor.execute('ALTER TABLE {table} RENAME TO {old}'.format(**names))
+    cursor.execute('CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) '
+                   'PARTITION BY RANGE (date)'.format(**names))
+    # Keep the id sequence when the old table is dropped
+    cursor.execute('ALTER SEQUENCE {0} OWNED BY {table}.id'.format(sequence, **names))
+    cursor.execute('CREATE TABLE {0} PARTITION OF {table} DEFAULT'
+                   .format(_quote(table + '_default'), **names))
+
+    cursor.execute('SELECT MIN(date) FROM {old}'.format(**names))
+    first = cursor.fetchone()[0] or date.today()
+    month, last = month_start(first), month_start(date.today())
+    for i in range(months_ahead):
+        last = next_month(last)
+    while month <= last:
+        _create_partition(cursor, table, month)
+        month = next_month(month)
+
+    cursor.execute('INSERT INTO {table} SELECT * FROM {old}'.format(**names))
+    cursor.execute('DROP TABLE {old}'.format(**names))
+
+    for name, kind, definition, columns in constraints:
+        if kind in ('p', 'u'):
+            # Unique keys of a partitioned table include its partition key
+            if 'date' not in columns:
+                columns = list(columns) + ['date']
+            definition = '{0} ({1})'.format('PRIMARY KEY' if kind == 'p' else 'UNIQUE',
+                                            ', '.join(_quote(column) for column in columns))
+        cursor.execute('ALTER TABLE {table} ADD CONSTRAINT {0} {1}'
+                       .format(_quote(name), definition, **names))
+    for index in indexes:
+        cursor.execute(index)
+
+
+def partition_tables(conn=connection):
+    """
+    Partition every table of PARTITIONED_TABLES that isn't yet. Returns the tables
+    partitioned, none if the server doesn't support declarative partitioning.
+    """
+    if not supported(conn):
+        return []
+    partitioned = []
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        # Deferred checks of the copied rows would block altering the tables afterwards
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(cursor, table):
+                partition_table(cursor, table)
+                partitioned.append(table)
+    return partitioned
@@ -0,0 +1,66 @@
+from django.db import connection, transaction
+from .models import Batch, ControlChart, ControlPoint, Summary
+from .columnar import batch_columns
+from .counters import batch_dates
+from . import rawstore, report_cache
+
+# Deleting a Batch through the ORM collects every dependent row into memory first. A purge
+# deletes the batch with one DELETE per table instead, in one transaction. The batch's
+# rollups, counters, calendar entries and control charts are rows of the batch and go with
+# it.
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _batch_tables():
+    # (model, column) of every table referencing Batch, Summary last
+    tables = [(relation.related_model, relation.field.column)
+              for relation in Batch._meta.related_objects
+              if relation.related_model is not Summary]
+    return tables + [(Summary, Summary._meta.get_field('batch').column)]
+
+
+def purge_batch(batch_id):
+    """
+    Delete a batch and all of its rows with set based statements, in one transaction.
+    Returns {table: rows deleted}, empty if the batch doesn't exist.
+    """
+    dates = batch_dates(batch_id)
+    deleted = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        name = (Batch.objects.select_for_update().filter(pk=batch_id)
+                .values_list('batch_id', flat=True).first())
+        if name is None:
+            return deleted
+
+        cursor.execute(
+            'DELETE FROM {0} WHERE {1} IN (SELECT id FROM {2} WHERE batch_id = %s)'.format(
+                _quote(ControlPoint._meta.db_table),
+                _quote(ControlPoint._meta.get_field('chart').column),
+                _quote(ControlChart._meta.db_table)),
+            [batch_id])
+        deleted[ControlPoint._meta.db_table] = cursor.rowcount
+
+        for model, column in _batch_tables():
+            sql = 'DELETE FROM {0} WHERE {1} = %s'.format(_quote(model._meta.db_table),
+                                                          _quote(column))
+            params = [batch_id]
+            # Bounded to the batch's date partitions
+            if dates is not None and any(field.name == 'date'
+                                         for field in model._meta.concrete_fields):
+                sql += ' AND date BETWEEN %s AND %s'
+                params.extend(dates)
+            cursor.execute(sql, params)
+            deleted[model._meta.db_table] = cursor.rowcount
+
+        cursor.execute('DELETE FROM {0} WHERE id = %s'.format(_quote(Batch._meta.db_table)),
+                       [batch_id])
+        deleted[Batch._meta.db_table] = cursor.rowcount
+
+    batch_columns.invalidate(batch_id)
+    report_cache.evict(batch_id)
+    if rawstore.enabled():
+        rawstore.delete_batch(name)
+    return deleted
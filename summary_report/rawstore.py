@@ -0,0 +1,113 @@
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+
+from .aggregates import MEAN_FIELDS
+
+# Optional store of the per-part measurements behind MeasurementMean, enabled by setting
+# CSIS_RAW_STORE to a directory. Each segment is one compressed NumPy archive,
+# <root>/<batch>/<date>_<time>.npz, holding a float32 column per measurement field (NaN
+# where a part has no value), the parts' overall_result codes, and the result names.
+STORE_ROOT = getattr(settings, 'CSIS_RAW_STORE', None)
+
+FILE_FORMAT = '%Y%m%d_%H%M%S%f'
+
+# Batch names become directory names, so only those that can't leave STORE_ROOT
+BATCH_NAME = re.compile(r'^[A-Za-z0-9_-]+\Z')
+
+
+def enabled():
+    return bool(STORE_ROOT)
+
+
+def _batch_dir(batch_id):
+    if not BATCH_NAME.match(batch_id):
+        raise ValueError('batch %r is not a valid raw store name' % batch_id)
+    return os.path.join(STORE_ROOT, batch_id)
+
+
+def segment_path(batch_id, date, time):
+    return os.path.join(_batch_dir(batch_id),
+                        datetime.combine(date, time).strftime(FILE_FORMAT) + '.npz')
+
+
+def write_segment(batch_id, date, time, parts):
+    """
+    Store a segment's parts, given as {'overall_result': [...], field: [...]}, replacing
+    any parts already stored for it.
+    """
+    results = sorted(set(parts['overall_result']))
+    codes = {result: code for code, result in enumerate(results)}
+    arrays = {field: np.asarray(parts[field], dtype=np.float32)
+              for field in MEAN_FIELDS if field in parts}
+    arrays['overall_result'] = np.array([codes[result] for result in parts['overall_result']],
+                                        dtype=np.int16)
+    arrays['results'] = np.array(results, dtype=np.unicode_)
+
+    path = segment_path(batch_id, date, time)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed, so readers never see a partial file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as temp_file:
+        np.savez_compressed(temp_file, **arrays)
+    os.replace(temp_path, path)
+
+
+def write_segments(segments):
+    """
+    Store the parts of parsed segments that carry them (see csis.parse_rows).
+    """
+    for segment in segments:
+        if segment.get('parts'):
+            write_segment(segment['batch'], segment['date'], segment['time'], segment['parts'])
+
+
+def _segment_files(batch_id):
+    try:
+        names = os.listdir(_batch_dir(batch_id))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.endswith('.npz'))
+
+
+def iter_segments(batch_id, fields=MEAN_FIELDS, overall_result=None):
+    """
+    Stream a batch's stored parts one segment at a time, in timestamp order, as
+    (datetime, {field: array}), optionally only the parts with the given overall_result.
+    Only the requested columns are decompressed.
+    """
+    for name in _segment_files(batch_id):
+        timestamp = datetime.strptime(name[:-len('.npz')], FILE_FORMAT)
+        with np.load(os.path.join(_batch_dir(batch_id), name)) as data:
+            mask = slice(None)
+            if overall_result is not None:
+                results = data['results'].tolist()
+                if overall_result not in results:
+                    continue
+                mask = data['overall_result'] == results.index(overall_result)
+            yield timestamp, {field: data[field][mask] for field in fields if field in data}
+
+
+def batch_columns(batch_id, fields=MEAN_FIELDS, overall_result=None):
+    """
+    All of a batch's stored parts as one array per field.
+    """
+    columns = {field: [] for field in fields}
+    for timestamp, segment in iter_segments(batch_id, fields, overall_result):
+        for field, values in segment.items():
+            columns[field].append(values)
+    return {field: np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float32)
+            for field, arrays in columns.items()}
+
+
+def delete_batch(batch_id):
+    """
+    Remove every stored part of a batch.
+    """
+    for name in _segment_files(batch_id):
+        os.remove(os.path.join(_batch_dir(batch_id), name))
+    if os.path.isdir(_batch_dir(batch_id)):
+        os.rmdir(_batch_dir(batch_id))
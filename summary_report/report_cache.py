@@ -0,0 +1,62 @@
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+
+# Cached reports are dropped by changing the batch's version (or the global version, for
+# changes such as corrections that touch every report) rather than by deleting keys.
+KEY_PREFIX = 'summary_report'
+REPORT_TIMEOUT = getattr(settings, 'CSIS_REPORT_CACHE_SECONDS', 24 * 60 * 60)
+
+GLOBAL = '*'
+
+
+def _version_key(batch):
+    return '%s:version:%s' % (KEY_PREFIX, batch)
+
+
+def _version(batch):
+    # A version that was evicted or never set starts over with a fresh value, so entries
+    # stored under an older version can't come back.
+    return cache.get_or_set(_version_key(batch), uuid4().hex, None)
+
+
+def version(batch=GLOBAL):
+    """
+    Current version of a batch's cached data, changed by evict(batch).
+    """
+    return _version(batch)
+
+
+def report_key(kind, *parts):
+    """
+    Cache key of a report of the given kind for the batch given as the first part.
+    """
+    batch = parts[0]
+    return ':'.join([KEY_PREFIX, kind, _version(GLOBAL), _version(batch)]
+                    + [str(part) for part in parts])
+
+
+def cached(kind, build, batch, *parts):
+    """
+    Cached result of build() for a report of the given kind, built on a miss.
+    """
+    key = report_key(kind, batch, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, REPORT_TIMEOUT)
+    return value
+
+
+def get_report(category, batch, segment, build):
+    """
+    Cached stats report context, built with build(category, batch, segment) on a miss.
+    """
+    return cached('stats', lambda: build(category, batch, segment), batch, category, segment)
+
+
+def evict(batch=GLOBAL):
+    """
+    Drop every cached report of a batch, or of all batches when none is given.
+    """
+    cache.set(_version_key(batch), uuid4().hex, None)
@@ -0,0 +1,58 @@
+import threading
+from django.db import connections, router
+from .models import OverallResult
+
+# overall_result names are stored as the id of their OverallResult row (see
+# fields.ResultField). The lookup is held per process and reloaded when it meets a name or
+# code it doesn't know, which happens only when a new result first appears. New results
+# are committed on a connection of their own, so the lookup never holds a code that the
+# writing transaction rolls back.
+
+
+class ResultMap(object):
+
+    def __init__(self):
+        self._codes = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        codes = dict(OverallResult.objects.values_list('name', 'pk'))
+        with self._lock:
+            self._codes = codes
+            self._names = {code: name for name, code in codes.items()}
+
+    @staticmethod
+    def _create(name):
+        own = connections[router.db_for_write(OverallResult)].copy()
+        try:
+            with own.cursor() as cursor:
+                cursor.execute('INSERT INTO {0} (name) VALUES (%s) ON CONFLICT (name) DO NOTHING'
+                               .format(own.ops.quote_name(OverallResult._meta.db_table)),
+                               [name])
+        finally:
+            own.close()
+
+    def code(self, name, create=False):
+        """
+        Code of a result name; None for a name never stored, unless create is set.
+        """
+        code = self._codes.get(name)
+        if code is None:
+            self._load()
+            code = self._codes.get(name)
+            if code is None and create:
+                self._create(name)
+                self._load()
+                code = self._codes[name]
+        return code
+
+    def name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            self._load()
+            name = self._names[code]
+        return name
+
+
+result_map = ResultMap()
@@ -0,0 +1,128 @@
+from django.db import transaction
+from .models import Batch, Summary, StatsRollup
+from .aggregates import CATEGORIES, CATEGORY_RESULTS, merge_stats
+from .columnar import BatchColumns, batch_columns
+from .corrections import factors_dict
+
+
+def _as_json(values):
+    # Aggregates come back as Decimals, which JSONField can't serialize
+    return {field: float(value) for field, value in values.items()}
+
+
+def _rollup_stats(rollup):
+    return rollup.means, rollup.counts, rollup.tests, rollup.count
+
+
+def _build_rollup(batch_id, summary_id, category, stats, factors):
+    means_dict, counts_dict, tests_dict, tests_count_sum = stats
+    return StatsRollup(batch_id=batch_id, summary_id=summary_id, category=category,
+                       count=tests_count_sum,
+                       means=_as_json(means_dict),
+                       counts={field: int(value) for field, value in counts_dict.items()},
+                       tests=_as_json(tests_dict),
+                       factors=factors)
+
+
+def refresh_rollups(batch_id, summary_ids=()):
+    """
+    Rebuild the rollups of the given segments of a batch, then the batch total, which is
+    merged from the segment rollups rather than rescanned. Segment stats for every category
+    are computed from the columns of just those segments' rows; the batch's cached columns
+    are dropped, to be reloaded by the next read.
+    """
+    if not Batch.objects.filter(pk=batch_id).exists():
+        return
+    summary_ids = set(Summary.objects
+                      .filter(batch_id=batch_id, pk__in=summary_ids)
+                      .values_list('pk', flat=True))
+    batch_columns.invalidate(batch_id)
+    columns = BatchColumns(batch_id, summary_ids)
+    factors = factors_dict(columns.factors)
+    rollups = []
+    for category, overall_result in CATEGORY_RESULTS.items():
+        for summary_id, stats in columns.segments_stats(summary_ids, overall_result).items():
+            rollups.append(_build_rollup(batch_id, summary_id, category, stats, factors))
+
+    with transaction.atomic():
+        # Concurrent refreshes of a batch take turns, each writing the one batch total
+        Batch.objects.select_for_update().filter(pk=batch_id).exists()
+        StatsRollup.objects.filter(batch_id=batch_id, summary_id__in=summary_ids).delete()
+        StatsRollup.objects.bulk_create(rollups)
+        _refresh_total(batch_id, factors)
+
+
+def refresh_batch(batch_id):
+    """
+    Rebuild every rollup of a batch.
+    """
+    summary_ids = Summary.objects.filter(batch_id=batch_id).values_list('pk', flat=True)
+    refresh_rollups(batch_id, list(summary_ids))
+
+
+def _refresh_total(batch_id, factors):
+    segment_rollups = (StatsRollup.objects
+                       .filter(batch_id=batch_id, summary__isnull=False))
+    by_category = {category: [] for category in CATEGORY_RESULTS}
+    for rollup in segment_rollups:
+        by_category[rollup.category].append(_rollup_stats(rollup))
+
+    StatsRollup.objects.filter(batch_id=batch_id, summary__isnull=True).delete()
+    StatsRollup.objects.bulk_create(
+        _build_rollup(batch_id, None, category, merge_stats(parts), factors)
+        for category, parts in by_category.items()
+    )
+
+
+def report_stats(category, batch, segment=None):
+    """
+    Stats for one report, read from its rollup. Batches that have no rollups yet (loaded
+    before rollups existed) are computed from their columns.
+    """
+    rollup = (StatsRollup.objects
+              .filter(batch_id=batch, summary_id=segment or None, category=category)
+              .first())
+    if rollup is not None:
+        return _rollup_stats(rollup)
+    return batch_columns.get(batch).stats(segment, CATEGORY_RESULTS[category])
+
+
+def category_stats(batch, segment=None, every_segment=False):
+    """
+    Stats of all categories at once for the batch total, one segment, or every segment,
+    read with a single rollup query. Returns {summary_id: {category: stats}}, keyed by None
+    for the batch total. Batches without rollups are computed from one load of their columns.
+    """
+    if every_segment:
+        summary_ids = list(Summary.objects.filter(batch_id=batch).values_list('pk', flat=True))
+        if not summary_ids:
+            # Archived batches only have their rollups live, see archive.py
+            summary_ids = list(StatsRollup.objects
+                               .filter(batch_id=batch, summary__isnull=False,
+                                       category='inspected')
+                               .values_list('summary_id', flat=True))
+    else:
+        summary_ids = [int(segment) if segment else None]
+
+    report = {summary_id: {} for summary_id in summary_ids}
+    rollups = StatsRollup.objects.filter(batch_id=batch)
+    if every_segment:
+        rollups = rollups.filter(summary__isnull=False)
+    else:
+        rollups = rollups.filter(summary_id=summary_ids[0])
+    for rollup in rollups:
+        if rollup.summary_id in report:
+            report[rollup.summary_id][rollup.category] = _rollup_stats(rollup)
+    if all(len(categories) == len(CATEGORIES) for categories in report.values()):
+        return report
+
+    columns = batch_columns.get(batch)
+    for category in CATEGORIES:
+        overall_result = CATEGORY_RESULTS[category]
+        if every_segment:
+            for summary_id, stats in columns.segments_stats(summary_ids,
+                                                            overall_result).items():
+                report[summary_id][category] = stats
+        else:
+            report[summary_ids[0]][category] = columns.stats(segment, overall_result)
+    return report
@@ -0,0 +1,116 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Batch, Summary, TestPassPercent, MeasurementMean, MeasurementCount, \
+    MeasurementSketch, MeasurementCorrection
+from .rollups import refresh_batch, refresh_rollups
+from . import counters
+from . import report_cache
+from . import spc
+from .corrections import correction_map, recompute_rollups, zeroed_batches
+
+# (batch_id, summary_id) segments waiting for the current transaction to commit
+_pending = threading.local()
+
+
+def schedule_refresh(batch_id, summary_id):
+    """
+    Queue a segment for a rollup refresh once the current transaction commits. Segments
+    saved together are refreshed once, however many of their rows changed.
+    """
+    if not hasattr(_pending, 'segments'):
+        _pending.segments = set()
+    _pending.segments.add((batch_id, summary_id))
+    transaction.on_commit(_run_pending)
+
+
+def _run_pending():
+    segments = getattr(_pending, 'segments', None)
+    if not segments:
+        return
+    _pending.segments = set()
+
+    batches = {}
+    for batch_id, summary_id in segments:
+        batches.setdefault(batch_id, set()).add(summary_id)
+    for batch_id, summary_ids in batches.items():
+        segments_changed(batch_id, summary_ids)
+
+
+def segments_changed(batch_id, summary_ids):
+    """
+    Bring a batch's derived report data up to date after rows of the given segments were
+    written. Paths that skip model signals (bulk loads) call this directly.
+    """
+    refresh_rollups(batch_id, summary_ids)
+    # Charts read the segments' new rollups
+    spc.chart_segments(batch_id, summary_ids)
+    Batch.objects.filter(pk=batch_id).update(modified=timezone.now())
+    report_cache.evict(batch_id)
+
+
+def corrections_changed():
+    """
+    Bring every batch's derived report data up to date after the corrections changed:
+    the new factors are re-applied to the stored rollups (rebuilding those zeroed by a
+    former factor of 0), and the charts of corrected means rebuilt from them.
+    """
+    correction_map.invalidate()
+    recompute_rollups()
+    for batch_id in zeroed_batches():
+        refresh_batch(batch_id)
+    spc.rebuild_charts()
+    Batch.objects.update(modified=timezone.now())
+    report_cache.evict()
+
+
+@receiver(post_save, sender=Summary)
+@receiver(post_delete, sender=Summary)
+def summary_changed(sender, instance, **kwargs):
+    schedule_refresh(instance.batch_id, instance.pk)
+
+
+@receiver(post_save, sender=Summary)
+def summary_saved(sender, instance, created, **kwargs):
+    # Counters are kept in the same transaction as the Summary write
+    if created:
+        counters.add_summary(instance)
+    else:
+        counters.recount_batch(instance.batch_id)
+        # Child rows are partitioned by their segment's date
+        for model in (TestPassPercent, MeasurementMean, MeasurementCount, MeasurementSketch):
+            (model.objects
+             .filter(summary_id=instance.pk)
+             .exclude(date=instance.date)
+             .update(date=instance.date))
+
+
+@receiver(pre_save, sender=TestPassPercent)
+@receiver(pre_save, sender=MeasurementMean)
+@receiver(pre_save, sender=MeasurementCount)
+@receiver(pre_save, sender=MeasurementSketch)
+def measurement_saving(sender, instance, **kwargs):
+    instance.date = instance.summary.date
+
+
+@receiver(post_delete, sender=Summary)
+def summary_deleted(sender, instance, **kwargs):
+    counters.add_summary(instance, sign=-1)
+
+
+@receiver(post_save, sender=TestPassPercent)
+@receiver(post_delete, sender=TestPassPercent)
+@receiver(post_save, sender=MeasurementMean)
+@receiver(post_delete, sender=MeasurementMean)
+@receiver(post_save, sender=MeasurementCount)
+@receiver(post_delete, sender=MeasurementCount)
+def measurement_changed(sender, instance, **kwargs):
+    schedule_refresh(instance.batch_id, instance.summary_id)
+
+
+@receiver(post_save, sender=MeasurementCorrection)
+@receiver(post_delete, sender=MeasurementCorrection)
+def correction_changed(sender, instance, **kwargs):
+    transaction.on_commit(corrections_changed)
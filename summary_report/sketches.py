@@ -0,0 +1,132 @@
+import math
+import numpy as np
+from .aggregates import MEAN_FIELDS
+from .corrections import correction_map
+from .models import MeasurementSketch
+
+# Quantile sketches of the parts behind each MeasurementMean row, stored in
+# MeasurementSketch as {field: sketch}. A sketch is a log-bucket histogram (DDSketch): a
+# value x is counted in bucket ceil(log_gamma(|x|)), gamma = (1 + a) / (1 - a), so every
+# quantile read from it is within relative error a of the true one. Sketches merge exactly
+# by adding bucket counts, so percentiles over any set of segments cost O(segments).
+#   {'zeros': n, 'positive': {bucket: n}, 'negative': {bucket: n},
+#    'moments': [n, sum, sum of squares]}
+# The exact moments, merged by adding, give the mean and standard deviation (capability.py).
+# Changing the accuracy invalidates the stored sketches.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Magnitudes below this count as zero
+MIN_VALUE = 1e-9
+
+
+def _buckets(values):
+    indexes, counts = np.unique(np.ceil(np.log(values) / LOG_GAMMA).astype(np.int64),
+                                return_counts=True)
+    # JSON object keys are strings
+    return {str(index): int(count) for index, count in zip(indexes, counts)}
+
+
+def build(values):
+    """
+    Sketch of an array of values; NaN (not measured) is skipped.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    return {'zeros': int(np.count_nonzero(np.abs(values) < MIN_VALUE)),
+            'positive': _buckets(values[values >= MIN_VALUE]),
+            'negative': _buckets(-values[values <= -MIN_VALUE]),
+            'moments': [len(values), float(values.sum()), float(np.square(values).sum())]}
+
+
+def part_sketches(parts):
+    """
+    Sketches of a parsed segment's parts (see csis.parse_rows), in the layout of its
+    other child records: {overall_result: {'sketches': {field: sketch}}}.
+    """
+    if not parts:
+        return {}
+    results = np.array(parts['overall_result'])
+    sketches = {}
+    for overall_result in set(parts['overall_result']):
+        selected = results == overall_result
+        sketches[overall_result] = {'sketches': {
+            field: build(np.asarray(parts[field], dtype=np.float64)[selected])
+            for field in MEAN_FIELDS if field in parts
+        }}
+    return sketches
+
+
+def merge(sketches):
+    merged = {'zeros': 0, 'positive': {}, 'negative': {}, 'moments': [0, 0.0, 0.0]}
+    for sketch in sketches:
+        merged['zeros'] += sketch['zeros']
+        merged['moments'] = [total + part for total, part in zip(merged['moments'],
+                                                                  sketch['moments'])]
+        for sign in ('positive', 'negative'):
+            buckets = merged[sign]
+            for index, count in sketch[sign].items():
+                buckets[index] = buckets.get(index, 0) + count
+    return merged
+
+
+def count(sketch):
+    return (sketch['zeros'] + sum(sketch['positive'].values())
+            + sum(sketch['negative'].values()))
+
+
+def _bucket_value(index):
+    # The value within relative error of every value in bucket index
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def quantiles(sketch, qs):
+    """
+    Values at the quantiles qs (0-1) of a sketch, None for an empty sketch.
+    """
+    total = count(sketch)
+    if not total:
+        return [None for q in qs]
+    # Buckets in ascending value order: most negative first
+    ordered = [(-_bucket_value(int(index)), n) for index, n in
+               sorted(sketch['negative'].items(), key=lambda item: -int(item[0]))]
+    ordered.append((0.0, sketch['zeros']))
+    ordered += [(_bucket_value(int(index)), n) for index, n in
+                sorted(sketch['positive'].items(), key=lambda item: int(item[0]))]
+
+    values = []
+    for q in qs:
+        rank = q * (total - 1)
+        seen = 0
+        for value, n in ordered:
+            seen += n
+            if seen > rank:
+                values.append(value)
+                break
+    return values
+
+
+def percentiles(fields, percents, overall_result=None, **filters):
+    """
+    {field: [value at each percent (0-100)]} over every segment's parts that match the
+    MeasurementSketch filters, e.g. batch_id__in=[...] or date__year=2016,
+    merged from the stored sketches without reading any part data. Sketches hold the
+    parts as measured; the values are scaled by the current correction factors.
+    """
+    rows = MeasurementSketch.objects.filter(**filters)
+    if overall_result is not None:
+        rows = rows.filter(overall_result=overall_result)
+    by_field = {field: [] for field in fields}
+    for row in rows.values_list('sketches', flat=True).iterator():
+        for field in fields:
+            if field in row:
+                by_field[field].append(row[field])
+    qs = [percent / 100.0 for percent in percents]
+    version, factors = correction_map.current()
+    percentiles = {}
+    for field, sketches in by_field.items():
+        factor = factors[MEAN_FIELDS.index(field)]
+        percentiles[field] = [None if value is None else value * factor
+                              for value in quantiles(merge(sketches), qs)]
+    return percentiles
@@ -0,0 +1,241 @@
+import math
+from collections import OrderedDict
+from django.db import transaction
+from django.db.models import Min, Q
+from .models import Batch, ControlChart, ControlPoint, StatsRollup, Summary
+
+# Control charts (individuals/X-bar, EWMA and CUSUM) over each batch's segments, each
+# segment one point. A chart's running state lives on its ControlChart row and is advanced
+# in O(1) per new segment; center and sigma are estimated from the points so far, sigma
+# from the average moving range. Every point keeps the state after it, so segments that
+# change earlier points recompute the chart from the first of them on, not from scratch.
+# Points are numbered in chart order, so the chart data of the last N points is an index
+# read.
+
+# Charted metric: where its value comes from, a Summary field or the segment's mean over
+# every result (its 'inspected' rollup)
+CHART_METRICS = OrderedDict((
+    ('good_percent', 'summary'),
+    ('dimension_median_od', 'means'),
+    ('flat_inner_diameter_min', 'means'),
+))
+
+EWMA_LAMBDA = 0.2
+# CUSUM reference value and decision interval, in sigmas
+CUSUM_K = 0.5
+CUSUM_H = 5
+# Control limits, in sigmas
+LIMIT_SIGMAS = 3
+# d2 constant of moving ranges of two points
+D2 = 1.128
+
+# Segments per query when a chart is recomputed from history
+REBUILD_CHUNK = 2000
+
+
+def sigma(chart):
+    if chart.points < 2:
+        return None
+    return chart.moving_ranges / (chart.points - 1) / D2
+
+
+def _reset(chart):
+    chart.points = 0
+    chart.mean = chart.squares = chart.moving_ranges = 0
+    chart.last_value = chart.ewma = None
+    chart.cusum_high = chart.cusum_low = 0
+    chart.last_date = chart.last_time = None
+
+
+def _restore(chart, point):
+    # The chart's state as it was after `point`
+    chart.points = point.number
+    chart.mean, chart.squares, chart.moving_ranges = point.mean, point.squares, point.moving_ranges
+    chart.last_value, chart.ewma = point.value, point.ewma
+    chart.cusum_high, chart.cusum_low = point.cusum_high, point.cusum_low
+    chart.last_date, chart.last_time = point.summary.date, point.summary.time
+
+
+def _add_point(chart, summary, value):
+    """
+    Advance a chart's state by one segment, returning its (unsaved) ControlPoint.
+    """
+    # CUSUM is taken against the estimates before this point
+    center, spread = chart.mean, sigma(chart)
+    if spread:
+        chart.cusum_high = max(0, chart.cusum_high + value - center - CUSUM_K * spread)
+        chart.cusum_low = max(0, chart.cusum_low + center - value - CUSUM_K * spread)
+    if chart.points:
+        chart.ewma = EWMA_LAMBDA * value + (1 - EWMA_LAMBDA) * chart.ewma
+        chart.moving_ranges += abs(value - chart.last_value)
+    else:
+        chart.ewma = value
+
+    chart.points += 1
+    delta = value - chart.mean
+    chart.mean += delta / chart.points
+    chart.squares += delta * (value - chart.mean)
+    chart.last_value = value
+    chart.last_date, chart.last_time = summary.date, summary.time
+    return ControlPoint(chart=chart, summary=summary, number=chart.points, value=value,
+                        mean=chart.mean, squares=chart.squares,
+                        moving_ranges=chart.moving_ranges, ewma=chart.ewma,
+                        cusum_high=chart.cusum_high, cusum_low=chart.cusum_low)
+
+
+def _segment_values(summaries):
+    """
+    {summary_id: {metric: value}} of Summary rows, without metrics they have no value for.
+    """
+    means = dict(StatsRollup.objects
+                 .filter(summary__in=[summary.pk for summary in summaries],
+                         category='inspected')
+                 .values_list('summary_id', 'means'))
+    values = {}
+    for summary in summaries:
+        values[summary.pk] = {}
+        for metric, source in CHART_METRICS.items():
+            if source == 'summary':
+                value = getattr(summary, metric)
+            else:
+                value = means.get(summary.pk, {}).get(metric)
+            if value is not None and not math.isnan(value):
+                values[summary.pk][metric] = float(value)
+    return values
+
+
+def _append(chart, summaries):
+    values = _segment_values(summaries)
+    ControlPoint.objects.bulk_create(
+        _add_point(chart, summary, values[summary.pk][chart.metric])
+        for summary in summaries if chart.metric in values[summary.pk])
+
+
+def _recompute(chart, start=1):
+    """
+    Recompute a chart from its point number `start` on, from the state after the point
+    before it and the batch's segments after that point's.
+    """
+    previous = (ControlPoint.objects
+                .filter(chart=chart, number__lt=start)
+                .select_related('summary')
+                .order_by('-number')
+                .first())
+    ControlPoint.objects.filter(chart=chart, number__gte=start).delete()
+    summaries = Summary.objects.filter(batch_id=chart.batch_id).order_by('date', 'time', 'pk')
+    if previous is None:
+        _reset(chart)
+    else:
+        _restore(chart, previous)
+        summaries = summaries.extra(where=['(date, time, id) > (%s, %s, %s)'],
+                                    params=[previous.summary.date, previous.summary.time,
+                                            previous.summary_id])
+    chunk = []
+    for summary in summaries.iterator():
+        chunk.append(summary)
+        if len(chunk) == REBUILD_CHUNK:
+            _append(chart, chunk)
+            chunk = []
+    _append(chart, chunk)
+    chart.save()
+
+
+def _first_changed(chart, summary_ids, summaries):
+    """
+    Number of the chart's first point that the written segments change, None if they only
+    add points after its last one.
+    """
+    # Points of re-sent, edited or deleted segments
+    start = (ControlPoint.objects
+             .filter(chart=chart, summary_id__in=summary_ids)
+             .aggregate(start=Min('number'))['start'])
+    first = summaries[0] if summaries else None
+    if (first is not None and chart.last_date is not None
+            and (first.date, first.time) < (chart.last_date, chart.last_time)):
+        # A segment arriving out of order moves the points after it
+        later = (ControlPoint.objects
+                 .filter(chart=chart)
+                 .filter(Q(summary__date__gt=first.date)
+                         | Q(summary__date=first.date, summary__time__gte=first.time))
+                 .aggregate(start=Min('number'))['start']) or 1
+        start = min(start or later, later)
+    return start
+
+
+def _chart(batch_id, metric):
+    ControlChart.objects.get_or_create(batch_id=batch_id, metric=metric)
+    return ControlChart.objects.select_for_update().get(batch_id=batch_id, metric=metric)
+
+
+def chart_segments(batch_id, summary_ids):
+    """
+    Add written segments of a batch to the batch's charts. New segments later than a
+    chart's last point are appended in O(1) each; segments that were re-sent, edited,
+    deleted or arrive out of order recompute the chart from the first point they change.
+    """
+    summaries = list(Summary.objects
+                     .filter(batch_id=batch_id, pk__in=summary_ids)
+                     .order_by('date', 'time', 'pk'))
+    with transaction.atomic():
+        for metric in CHART_METRICS:
+            chart = _chart(batch_id, metric)
+            start = _first_changed(chart, summary_ids, summaries)
+            if start is None:
+                _append(chart, summaries)
+                chart.save()
+            else:
+                _recompute(chart, start)
+
+
+def rebuild_charts(batch_ids=None):
+    """
+    Recompute the charts of the given batches, by default every live one, from scratch.
+    Each batch's charts are rebuilt in their own transaction.
+    """
+    if batch_ids is None:
+        batch_ids = Batch.objects.filter(archived__isnull=True).values_list('pk', flat=True)
+    for batch_id in batch_ids:
+        with transaction.atomic():
+            for metric in CHART_METRICS:
+                _recompute(_chart(batch_id, metric))
+
+
+def chart_data(chart, last=100):
+    """
+    The chart's limits, from its running state, and its last points in chart order.
+    """
+    center, spread = chart.mean, sigma(chart)
+    data = {
+        'batch': chart.batch.batch_id,
+        'metric': chart.metric,
+        'points_total': chart.points,
+        'center': center if chart.points else None,
+        'sigma': spread,
+        'overall_sigma': (math.sqrt(chart.squares / (chart.points - 1))
+                          if chart.points > 1 else None),
+        'xbar': None, 'ewma': None, 'cusum': None,
+    }
+    if spread:
+        ewma_spread = LIMIT_SIGMAS * spread * math.sqrt(EWMA_LAMBDA / (2 - EWMA_LAMBDA))
+        data.update({
+            'xbar': {'ucl': center + LIMIT_SIGMAS * spread,
+                     'lcl': center - LIMIT_SIGMAS * spread},
+            'ewma': {'lambda': EWMA_LAMBDA,
+                     'ucl': center + ewma_spread,
+                     'lcl': center - ewma_spread},
+            'cusum': {'k': CUSUM_K * spread, 'h': CUSUM_H * spread},
+        })
+
+    points = (ControlPoint.objects
+              .filter(chart=chart)
+              .select_related('summary')
+              .order_by('-number')[:last])
+    data['points'] = [{'segment': point.summary_id,
+                       'date': point.summary.date,
+                       'time': point.summary.time,
+                       'value': point.value,
+                       'ewma': point.ewma,
+                       'cusum_high': point.cusum_high,
+                       'cusum_low': point.cusum_low,
+                       } for point in reversed(list(points))]
+    return data
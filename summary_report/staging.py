@@ -0,0 +1,235 @@
+import csv
+import io
+import json
+from django.db import connection, transaction
+from .models import Batch, Summary
+from .ingest import CHILD_MODELS, VALUE_FIELDS, _create_batches
+from . import counters, rawstore
+from .signals import segments_changed
+
+# Staged loads go into session temporary tables, invisible to (and never locking) the live
+# tables, and are published to the live tables in one short transaction, so report readers
+# see either none or all of a load. A segment staged more than once (re-sent, or in two
+# files) is published as its last copy.
+
+SEGMENT_KEYS = ('batch_id', 'date', 'time')
+
+
+class StagingError(ValueError):
+    pass
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _staging_table(key):
+    return _quote('csis_staging_' + key)
+
+
+def _columns(model, fields):
+    return [_quote(model._meta.get_field(name).column) for name in fields]
+
+
+def _keyed(key, columns):
+    # Rows of a staging table with their batch's key in batch_id, as in the live tables
+    return ('(SELECT b.id AS batch_id, g.date, g.time, {0} FROM {1} g '
+            'JOIN {2} b ON b.batch_id = g.batch_id)'
+            .format(', '.join('g.' + column for column in columns), _staging_table(key),
+                    _quote(Batch._meta.db_table)))
+
+
+class StagingWriter(object):
+    """
+    Writer with the SegmentWriter interface that COPYs segments into staging tables,
+    validates them there, and on close() publishes the whole load as upserts.
+    """
+
+    def __init__(self):
+        self._created = False
+        # Segments staged so far; staged rows carry the number of their segment's copy
+        self._copies = 0
+        # Parsed segments with parts, stored in the raw store once the load is published
+        self._parts = []
+
+    def _create_tables(self):
+        # Column types are copied from the live tables; segments are staged with their
+        # batch's batch_id, as batches may not exist until the load is published, and the
+        # number of the copy they belong to
+        summary_table = _quote(Summary._meta.db_table)
+        batch_table = _quote(Batch._meta.db_table)
+        segment_keys = '0 AS copy_number, b.batch_id, s.date, s.time'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS {0} AS SELECT {1}, {2} FROM {3} s, {4} b '
+                'WITH NO DATA'
+                .format(_staging_table('summary'), segment_keys,
+                        ', '.join('s.' + column
+                                  for column in _columns(Summary, VALUE_FIELDS['summary'])),
+                        summary_table, batch_table))
+            for key, model in CHILD_MODELS:
+                cursor.execute(
+                    'CREATE TEMP TABLE IF NOT EXISTS {0} AS SELECT {1}, c.overall_result, {2} '
+                    'FROM {3} c, {4} s, {5} b WITH NO DATA'
+                    .format(_staging_table(key), segment_keys,
+                            ', '.join('c.' + column
+                                      for column in _columns(model, VALUE_FIELDS[key])),
+                            _quote(model._meta.db_table), summary_table, batch_table))
+            for key in ('summary',) + tuple(key for key, model in CHILD_MODELS):
+                cursor.execute('TRUNCATE {0}'.format(_staging_table(key)))
+        self._created = True
+
+    @staticmethod
+    def _copy_value(value):
+        # JSON columns are copied as their text; JSONField prepares them as psycopg2 Json
+        # adapters, which hold the value in `adapted`
+        value = getattr(value, 'adapted', value)
+        return json.dumps(value) if isinstance(value, dict) else value
+
+    def _copy(self, cursor, key, rows):
+        data = io.StringIO()
+        csv.writer(data).writerows([self._copy_value(value) for value in row] for row in rows)
+        data.seek(0)
+        cursor.copy_expert('COPY {0} FROM STDIN WITH (FORMAT csv)'.format(_staging_table(key)),
+                           data)
+
+    def add(self, segments):
+        if not self._created:
+            self._create_tables()
+        copies = list(enumerate(segments, self._copies + 1))
+        self._copies += len(copies)
+        with connection.cursor() as cursor:
+            self._copy(cursor, 'summary', (
+                [number, segment['batch'], segment['date'], segment['time']]
+                + [segment['summary'][field] for field in VALUE_FIELDS['summary']]
+                for number, segment in copies))
+            for key, model in CHILD_MODELS:
+                # In their stored form: result codes, basis points (see fields.py)
+                prepare = [model._meta.get_field(field).get_db_prep_save
+                           for field in ['overall_result'] + VALUE_FIELDS[key]]
+                self._copy(cursor, key, (
+                    [number, segment['batch'], segment['date'], segment['time']]
+                    + [prep(value, connection) for prep, value in zip(
+                        prepare, [overall_result] + [values[field]
+                                                     for field in VALUE_FIELDS[key]])]
+                    for number, segment in copies
+                    for overall_result, values in segment[key].items()))
+        if rawstore.enabled():
+            self._parts.extend(segment for segment in segments if segment.get('parts'))
+
+    def _drop_superseded(self):
+        # Every copy of a segment but its last, and their rows
+        join = ' AND '.join('g.{0} = h.{0}'.format(column) for column in SEGMENT_KEYS)
+        with connection.cursor() as cursor:
+            for key in ('summary',) + tuple(key for key, model in CHILD_MODELS):
+                cursor.execute('DELETE FROM {0} g USING {1} h WHERE {2} '
+                               'AND g.copy_number < h.copy_number'
+                               .format(_staging_table(key), _staging_table('summary'), join))
+
+    def validate(self):
+        """
+        Raise StagingError if the staged rows can't be published as they are.
+        """
+        keys = ', '.join(SEGMENT_KEYS)
+        checks = [
+            ('negative Summary count',
+             'SELECT {keys} FROM {summary} WHERE LEAST({counts}) < 0'),
+            ('Summary percent outside 0-100',
+             'SELECT {keys} FROM {summary} WHERE LEAST({percents}) < 0 '
+             'OR GREATEST({percents}) > 100'),
+        ]
+        for key, model in CHILD_MODELS:
+            table = _staging_table(key)
+            checks += [
+                ('%s row without a staged segment' % key,
+                 'SELECT c.batch_id, c.date, c.time FROM ' + table + ' c '
+                 'LEFT JOIN {summary} s USING ({keys}) WHERE s.batch_id IS NULL'),
+            ]
+        # Staged as basis points
+        checks.append(('test percent outside 0-100',
+                       'SELECT {keys} FROM ' + _staging_table('tests') +
+                       ' WHERE LEAST({tests}) < 0 OR GREATEST({tests}) > 10000'))
+
+        summary_fields = VALUE_FIELDS['summary']
+        names = {
+            'keys': keys,
+            'summary': _staging_table('summary'),
+            'counts': ', '.join(_columns(Summary, counters.COUNTER_FIELDS)),
+            'percents': ', '.join(_columns(Summary, [field for field in summary_fields
+                                                     if field.endswith('_percent')])),
+            'tests': ', '.join(_quote(field) for field in VALUE_FIELDS['tests']),
+        }
+        with connection.cursor() as cursor:
+            for problem, sql in checks:
+                cursor.execute(sql.format(**names) + ' LIMIT 5')
+                rows = cursor.fetchall()
+                if rows:
+                    raise StagingError('%s: %s' % (problem, ', '.join(
+                        ' '.join(str(value) for value in row) for row in rows)))
+
+    def _publish(self, cursor):
+        summary_table = _quote(Summary._meta.db_table)
+        segment_join = ' AND '.join('s.{0} = g.{0}'.format(column) for column in SEGMENT_KEYS)
+        staged_summary = _keyed('summary', _columns(Summary, VALUE_FIELDS['summary']))
+
+        cursor.execute('SELECT DISTINCT batch_id FROM {0}'.format(_staging_table('summary')))
+        _create_batches({row[0] for row in cursor.fetchall()})
+
+        columns = _columns(Summary, VALUE_FIELDS['summary'])
+        cursor.execute(
+            'INSERT INTO {table} ({keys}, {columns}) SELECT {keys}, {columns} FROM {staged} g '
+            'ON CONFLICT ({keys}) DO UPDATE SET {updates}'.format(
+                table=summary_table, staged=staged_summary,
+                keys=', '.join(SEGMENT_KEYS), columns=', '.join(columns),
+                updates=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns)))
+
+        for key, model in CHILD_MODELS:
+            table = _quote(model._meta.db_table)
+            columns = _columns(model, VALUE_FIELDS[key])
+            staged = _keyed(key, ['overall_result'] + columns)
+            cursor.execute(
+                'INSERT INTO {table} (batch_id, summary_id, overall_result, date, {columns}) '
+                'SELECT s.batch_id, s.id, g.overall_result, s.date, {staged_columns} '
+                'FROM {staged} g JOIN {summary} s ON {join} '
+                'ON CONFLICT (batch_id, summary_id, overall_result, date) '
+                'DO UPDATE SET {updates}'
+                .format(table=table, staged=staged, summary=summary_table,
+                        join=segment_join, columns=', '.join(columns),
+                        staged_columns=', '.join('g.' + column for column in columns),
+                        updates=', '.join('{0} = EXCLUDED.{0}'.format(column)
+                                          for column in columns)))
+            # Results the re-sent segments no longer have
+            cursor.execute(
+                'DELETE FROM {table} t USING {summary} s, {staged_summary} g '
+                'WHERE t.summary_id = s.id AND {join} AND NOT EXISTS ('
+                'SELECT 1 FROM {staged} c WHERE c.batch_id = s.batch_id AND c.date = s.date '
+                'AND c.time = s.time AND c.overall_result = t.overall_result)'
+                .format(table=table, summary=summary_table, join=segment_join,
+                        staged_summary=staged_summary, staged=staged))
+
+        cursor.execute('SELECT s.batch_id, s.id FROM {0} s JOIN {1} g ON {2}'.format(
+            summary_table, staged_summary, segment_join))
+        published = {}
+        for batch_id, summary_id in cursor.fetchall():
+            published.setdefault(batch_id, []).append(summary_id)
+        for batch_id in published:
+            counters.recount_batch(batch_id)
+        return published
+
+    def close(self):
+        """
+        Validate the staged rows and publish them to the live tables in one transaction,
+        then refresh the touched batches.
+        Returns {batch_id: [summary_id, ...]} of every published segment.
+        """
+        if not self._created:
+            return {}
+        self._drop_superseded()
+        self.validate()
+        with transaction.atomic(), connection.cursor() as cursor:
+            published = self._publish(cursor)
+        rawstore.write_segments(self._parts)
+        self._parts = []
+        for batch_id, summary_ids in published.items():
+            segments_changed(batch_id, summary_ids)
+        return published
@@ -1,6 +1,28 @@
+import tempfile
+from unittest import mock
+from django.db import IntegrityError, transaction
+from django.core.cache import cache
+from django.http import Http404
 from django.test import TestCase
 from datetime import datetime, date
-from .models import Batch, Summary, TestPassPercent, MeasurementMean
+from .models import Batch, Summary, TestPassPercent, MeasurementMean, MeasurementCount, \
+    StatsRollup, BatchMonth, StandardID, MeasurementStandard, ControlChart, MeasurementCorrection, \
+    ControlPoint, MeasurementSketch, OverallResult
+from .aggregates import MEAN_FIELDS, TEST_FIELDS, measurement_stats, test_stats
+from .rollups import refresh_batch, report_stats
+from .columnar import BatchColumns
+from . import report_cache
+from .counters import batch_dates, summary_totals
+from .csis import SUMMARY_COLUMNS, TEST_COLUMNS, MEASUREMENT_COLUMNS, ExportError, parse_rows
+from .ingest import load_segments
+from .buffer import BufferFull, BufferTooLarge, IngestBuffer
+from .staging import StagingError, StagingWriter
+from .capability import capability_report
+from .spc import rebuild_charts
+from .signals import corrections_changed
+from .corrections import correction_map
+from .views import batch_report_context, segment_page
+from . import archive, purge, rawstore, sketches, spc
 
 # Create your tests here.
 
@@ -11,13 +33,16 @@ class BatchModelTests(TestCase):
         Batch_id was set to unique. Testing that duplicates are thrown out.
         Update: Unique alone allowed duplicate entries. Made batch_id PK to get desired
         output.
+        Update: batch_id is a unique natural key again, beside an integer PK; saving a
+        duplicate fails.
         """
         batch = 'test'
         batch = Batch(batch_id=batch)
         batch.save()
         batch = 'test'
         batch = Batch(batch_id=batch)
-        batch.save()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            batch.save()
         batch_list = [batch.batch_id for batch in Batch.objects.all()]
         self.assertEqual(batch_list, ['test',])
 
@@ -33,3 +58,357 @@ class SummaryAids:
     @staticmethod
     def today_test_dict():
         return {'batch_id': 'test', 'date': date.today(), 'time': datetime.now().time()}
+
+
+class AggregateTests(TestCase):
+
+    def setUp(self):
+        self.batch = Batch.objects.create(batch_id='test')
+        counts = {'inspected': 10, 'good': 6, 'fail_general': 4, 'fail_od': 0,
+                  'fail_backward': 0, 'n_a': 0, 'gate_homes': 0, 'lost_homing': 0}
+        percents = {'good_percent': 60, 'fail_gen_percent': 40, 'fail_od_percent': 0,
+                    'fail_backward_percent': 0, 'n_a_percent': 0}
+        self.summary = Summary.objects.create(batch=self.batch, date=date.today(),
+                                              time=datetime.now().time(),
+                                              **dict(counts, **percents))
+        for result, mean, count, passed in (('Good', 1.0, 6, 100), ('Fail', 4.0, 2, 50)):
+            keys = {'batch': self.batch, 'summary': self.summary, 'overall_result': result}
+            MeasurementMean.objects.create(**dict(keys, **{f: mean for f in MEAN_FIELDS}))
+            MeasurementCount.objects.create(**dict(keys, **{f: count for f in MEAN_FIELDS}))
+            TestPassPercent.objects.create(**dict(keys, **{f: passed for f in TEST_FIELDS}))
+
+    def tearDown(self):
+        # Correction versions and cached reports live in the cache, which the test's
+        # rollback doesn't reach
+        cache.clear()
+        correction_map.invalidate()
+
+    def test_means_are_count_weighted(self):
+        means_dict, counts_dict = measurement_stats(self.batch.pk)
+        self.assertEqual(counts_dict['dimension_median_od'], 8)
+        self.assertAlmostEqual(float(means_dict['dimension_median_od']), 1.75)
+
+    def test_tests_are_summary_weighted(self):
+        tests_dict, tests_count_sum = test_stats(self.batch.pk)
+        self.assertEqual(tests_count_sum, 10)
+        self.assertAlmostEqual(float(tests_dict['round_end']), 80.0)
+
+    def test_category_filter(self):
+        means_dict, counts_dict = measurement_stats(self.batch.pk, self.summary.id, 'Fail')
+        self.assertEqual(counts_dict['flat_chip_area'], 2)
+        self.assertAlmostEqual(float(means_dict['flat_chip_area']), 4.0)
+
+    def test_rollup_matches_aggregates(self):
+        refresh_batch(self.batch.pk)
+        means_dict, counts_dict, tests_dict, tests_count_sum = report_stats('inspected',
+                                                                            self.batch.pk)
+        self.assertEqual(StatsRollup.objects.filter(summary__isnull=True).count(), 6)
+        self.assertEqual(tests_count_sum, 10)
+        self.assertEqual(counts_dict['dimension_median_od'], 8)
+        self.assertAlmostEqual(means_dict['dimension_median_od'], 1.75)
+        self.assertAlmostEqual(tests_dict['round_end'], 80.0)
+
+    def test_corrections_rebuild_zeroed_rollups(self):
+        refresh_batch(self.batch.pk)
+        correction = MeasurementCorrection.objects.create(measurement='odp_mdn_od_mm',
+                                                          correction_factor=0)
+        corrections_changed()
+        self.assertEqual(report_stats('inspected', self.batch.pk)[0]['dimension_median_od'], 0)
+        correction.correction_factor = 2
+        correction.save()
+        corrections_changed()
+        self.assertAlmostEqual(report_stats('inspected', self.batch.pk)[0]['dimension_median_od'],
+                               3.5)
+
+    def test_corrections_rescale_stored_rollups(self):
+        refresh_batch(self.batch.pk)
+        MeasurementCorrection.objects.create(measurement='odp_mdn_od_mm', correction_factor=2)
+        corrections_changed()
+        means_dict, counts_dict, tests_dict, tests_count_sum = report_stats('inspected',
+                                                                            self.batch.pk)
+        self.assertAlmostEqual(means_dict['dimension_median_od'], 3.5)
+        self.assertAlmostEqual(means_dict['flat_chip_area'], 1.75)
+        # New rollups are built from corrected columns
+        refresh_batch(self.batch.pk)
+        means_dict, counts_dict, tests_dict, tests_count_sum = report_stats('inspected',
+                                                                            self.batch.pk)
+        self.assertAlmostEqual(means_dict['dimension_median_od'], 3.5)
+
+    def test_columns_match_aggregates(self):
+        columns = BatchColumns(self.batch.pk)
+        means_dict, counts_dict, tests_dict, tests_count_sum = columns.stats(overall_result='Fail')
+        self.assertEqual(counts_dict['flat_chip_area'], 2)
+        self.assertAlmostEqual(means_dict['flat_chip_area'], 4.0)
+        self.assertEqual(tests_count_sum, 4)
+        segments = columns.segments_stats([self.summary.id])
+        self.assertAlmostEqual(segments[self.summary.id][0]['dimension_median_od'], 1.75)
+        self.assertAlmostEqual(segments[self.summary.id][2]['round_end'], 80.0)
+
+    def test_measurements_follow_segment_date(self):
+        self.assertEqual(set(MeasurementMean.objects.values_list('date', flat=True)),
+                         {self.summary.date})
+        self.summary.date = date(2016, 7, 22)
+        self.summary.save()
+        self.assertEqual(set(TestPassPercent.objects.values_list('date', flat=True)),
+                         {date(2016, 7, 22)})
+        self.assertEqual(batch_dates(self.batch.pk), (date(2016, 7, 1), date(2016, 7, 31)))
+
+    def test_results_and_percents_stored_compact(self):
+        self.assertEqual(set(OverallResult.objects.values_list('name', flat=True)),
+                         {'Good', 'Fail'})
+        row = TestPassPercent.objects.filter(overall_result='Fail').values_list(
+            'overall_result', 'round_end').get()
+        self.assertEqual(row, ('Fail', 50.0))
+        self.assertFalse(TestPassPercent.objects.filter(overall_result='Unknown').exists())
+
+    def test_archived_batches_read_from_archive(self):
+        refresh_batch(self.batch.pk)
+        spc.chart_segments(self.batch.pk, [self.summary.pk])
+        self.assertEqual(archive.archive_batch(self.batch.pk), 1)
+        self.assertFalse(Summary.objects.exists())
+        self.assertFalse(MeasurementMean.objects.exists())
+        self.assertFalse(ControlPoint.objects.exists())
+        summaries, next_after = segment_page(self.batch.pk)
+        self.assertEqual([summary.pk for summary in summaries], [self.summary.pk])
+        self.assertEqual(summaries[0].good_percent, 60)
+        means_dict, counts_dict, tests_dict, tests_count_sum = report_stats('inspected',
+                                                                            self.batch.pk)
+        self.assertAlmostEqual(means_dict['dimension_median_od'], 1.75)
+        self.assertEqual(archive.restore_batch(self.batch.pk), 1)
+        self.assertEqual(MeasurementMean.objects.filter(summary=self.summary).count(), 2)
+        self.assertEqual(ControlChart.objects.get(batch=self.batch, metric='good_percent').points,
+                         1)
+        self.assertEqual(test_stats(self.batch.pk)[1], 10)
+
+    def test_batch_report_of_unknown_segment(self):
+        refresh_batch(self.batch.pk)
+        with self.assertRaises(Http404):
+            batch_report_context(self.batch.pk, str(self.summary.pk + 1), False)
+
+    def test_purge_removes_batch_rows(self):
+        refresh_batch(self.batch.pk)
+        spc.chart_segments(self.batch.pk, [self.summary.pk])
+        deleted = purge.purge_batch(self.batch.pk)
+        self.assertEqual(deleted[MeasurementMean._meta.db_table], 2)
+        self.assertFalse(ControlChart.objects.exists())
+        self.assertFalse(ControlPoint.objects.exists())
+        self.assertFalse(Batch.objects.exists())
+        self.assertFalse(Summary.objects.exists())
+        self.assertFalse(StatsRollup.objects.exists())
+        self.assertFalse(BatchMonth.objects.exists())
+        self.assertEqual(purge.purge_batch(self.batch.pk), {})
+
+    def test_batch_counters_follow_summaries(self):
+        batch = Batch.objects.get(pk=self.batch.pk)
+        self.assertEqual((batch.inspected, batch.good, batch.fail_general), (10, 6, 4))
+        self.assertEqual(summary_totals(self.batch.pk)['inspected'], 10)
+        month = BatchMonth.objects.get(batch=self.batch)
+        self.assertEqual((month.year, month.month), (date.today().year, date.today().month))
+        self.assertEqual((month.segments, month.sensors), (1, 10))
+        self.summary.delete()
+        batch = Batch.objects.get(pk=self.batch.pk)
+        self.assertEqual((batch.inspected, batch.good, batch.fail_general), (0, 0, 0))
+        self.assertFalse(BatchMonth.objects.filter(batch=self.batch).exists())
+
+
+class ReportCacheTests(TestCase):
+
+    def test_evict_drops_batch_reports(self):
+        builds = []
+
+        def build(category, batch, segment):
+            builds.append((category, batch, segment))
+            return {'count': len(builds)}
+
+        self.assertEqual(report_cache.get_report('good', 'cached', None, build)['count'], 1)
+        self.assertEqual(report_cache.get_report('good', 'cached', None, build)['count'], 1)
+        report_cache.evict('other')
+        self.assertEqual(report_cache.get_report('good', 'cached', None, build)['count'], 1)
+        report_cache.evict('cached')
+        self.assertEqual(report_cache.get_report('good', 'cached', None, build)['count'], 2)
+        report_cache.evict()
+        self.assertEqual(report_cache.get_report('good', 'cached', None, build)['count'], 3)
+
+
+class IngestTests(TestCase):
+
+    @staticmethod
+    def export_rows():
+        keys = {'batch': 'ingest', 'date': '2016-07-22', 'time': '10:30:00'}
+        summary = dict(keys, record='summary', **{column: '0' for column in SUMMARY_COLUMNS})
+        summary.update({'inspected': '10', 'good': '6', 'fail_general': '4'})
+        rows = [summary]
+        for result, mean, count in (('Good', '1.0', '6'), ('Fail', '4.0', '2')):
+            result_keys = dict(keys, overall_result=result)
+            rows.append(dict(result_keys, record='test',
+                             **{column: '50' for column in TEST_COLUMNS}))
+            rows.append(dict(result_keys, record='mean',
+                             **{column: mean for column in MEASUREMENT_COLUMNS}))
+            rows.append(dict(result_keys, record='count',
+                             **{column: count for column in MEASUREMENT_COLUMNS}))
+        return rows
+
+    @staticmethod
+    def batch_key():
+        return Batch.objects.get(batch_id='ingest').pk
+
+    def test_parse_groups_rows_by_segment(self):
+        segments = parse_rows(self.export_rows())
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0]['date'], date(2016, 7, 22))
+        self.assertEqual(segments[0]['summary']['inspected'], 10)
+        self.assertEqual(segments[0]['means']['Fail']['dimension_median_od'], 4.0)
+
+    def test_parse_rejects_bad_values(self):
+        rows = self.export_rows()
+        rows[1]['re_station'] = 'x'
+        with self.assertRaises(ExportError):
+            parse_rows(rows)
+
+    def test_load_refreshes_derived_data(self):
+        load_segments(parse_rows(self.export_rows()))
+        self.assertEqual(MeasurementMean.objects.filter(batch__batch_id='ingest').count(), 2)
+        self.assertEqual(Batch.objects.get(batch_id='ingest').inspected, 10)
+        self.assertTrue(BatchMonth.objects.filter(batch__batch_id='ingest', year=2016,
+                                                  month=7).exists())
+        means_dict, counts_dict, tests_dict, tests_count_sum = report_stats('inspected', self.batch_key())
+        self.assertAlmostEqual(means_dict['dimension_median_od'], 1.75)
+
+    def test_upsert_replaces_resent_segments(self):
+        load_segments(parse_rows(self.export_rows()), upsert=True)
+        rows = [row for row in self.export_rows() if row.get('overall_result') != 'Fail']
+        rows[0]['inspected'] = '6'
+        load_segments(parse_rows(rows), upsert=True)
+        self.assertEqual(Summary.objects.filter(batch__batch_id='ingest').count(), 1)
+        self.assertEqual(MeasurementMean.objects.filter(batch__batch_id='ingest').count(), 1)
+        self.assertEqual(Batch.objects.get(batch_id='ingest').inspected, 6)
+
+    def test_raw_store_keeps_parts(self):
+        rows = self.export_rows()
+        keys = {'batch': 'ingest', 'date': '2016-07-22', 'time': '10:30:00'}
+        for result, od in (('Good', '1.5'), ('Fail', '4.5'), ('Good', '')):
+            rows.append(dict(keys, record='part', overall_result=result,
+                             **{column: od for column in MEASUREMENT_COLUMNS}))
+        with tempfile.TemporaryDirectory() as root, \
+                mock.patch.object(rawstore, 'STORE_ROOT', root):
+            load_segments(parse_rows(rows))
+            columns = rawstore.batch_columns('ingest', ['dimension_median_od'], 'Good')
+        self.assertEqual(len(columns['dimension_median_od']), 2)
+        self.assertEqual(columns['dimension_median_od'][0], 1.5)
+
+    def test_raw_store_rejects_paths(self):
+        with tempfile.TemporaryDirectory() as root, \
+                mock.patch.object(rawstore, 'STORE_ROOT', root):
+            with self.assertRaises(ValueError):
+                rawstore.delete_batch('../ingest')
+
+    def part_export_rows(self):
+        # Two segments, whose parts measure 1-50 and 51-100
+        rows = self.export_rows()
+        for time, values in (('10:30:00', range(1, 51)), ('10:45:00', range(51, 101))):
+            keys = {'batch': 'ingest', 'date': '2016-07-22', 'time': time}
+            if time != '10:30:00':
+                rows.append(dict(rows[0], **keys))
+            for value in values:
+                rows.append(dict(keys, record='part', overall_result='Good',
+                                 **{column: str(value) for column in MEASUREMENT_COLUMNS}))
+        return rows
+
+    def test_percentiles_merge_segment_sketches(self):
+        load_segments(parse_rows(self.part_export_rows()))
+        values = sketches.percentiles(['dimension_envelope_mm'], [50, 99],
+                                      date__year=2016, date__month=7)
+        median, p99 = values['dimension_envelope_mm']
+        self.assertAlmostEqual(median, 50, delta=0.5)
+        self.assertAlmostEqual(p99, 99, delta=1)
+
+    def test_capability_from_part_moments(self):
+        load_segments(parse_rows(self.part_export_rows()))
+        standard = StandardID.objects.create(group_name='ingest')
+        MeasurementStandard.objects.create(standard_id=standard, measurement='odp_envelope_mm',
+                                           min=0, max=101, nominal=50.5)
+        report = capability_report([self.batch_key()], standard)['dimension_envelope_mm']
+        self.assertEqual(report['count'], 100)
+        self.assertAlmostEqual(report['mean'], 50.5)
+        self.assertAlmostEqual(report['sigma'], 29.011, places=3)
+        self.assertAlmostEqual(report['cp'], 101 / (6 * 29.0115), places=3)
+        self.assertIsNone(capability_report([self.batch_key()], standard)['flat_chip_area']['cp'])
+        # Periods only cover the segments dated in them
+        august = (date(2016, 8, 1), date(2016, 8, 31))
+        report = capability_report([self.batch_key()], standard, dates=august)
+        self.assertEqual(report['dimension_envelope_mm']['count'], 0)
+
+    def test_charts_follow_segments(self):
+        rows = self.part_export_rows()
+        rows[0]['good_percent'] = '60'
+        load_segments(parse_rows(rows))
+        chart = ControlChart.objects.get(batch_id=self.batch_key(), metric='good_percent')
+        self.assertEqual(chart.points, 2)
+        self.assertAlmostEqual(chart.mean, 30)
+        self.assertAlmostEqual(spc.sigma(chart), 60 / spc.D2)
+        rebuild_charts()
+        chart.refresh_from_db()
+        self.assertAlmostEqual(chart.mean, 30)
+        data = spc.chart_data(chart, last=1)
+        self.assertEqual(data['batch'], 'ingest')
+        self.assertEqual([point['value'] for point in data['points']], [0])
+
+        # Deleting the first segment recomputes the chart from its point
+        first = Summary.objects.filter(batch_id=self.batch_key()).order_by('date', 'time').first()
+        summary_id = first.pk
+        first.delete()
+        spc.chart_segments(self.batch_key(), [summary_id])
+        chart.refresh_from_db()
+        self.assertEqual(chart.points, 1)
+        self.assertEqual(chart.mean, 0)
+        self.assertEqual(list(ControlPoint.objects.filter(chart=chart)
+                              .values_list('number', flat=True)), [1])
+
+    def test_staged_load_publishes_valid_segments(self):
+        writer = StagingWriter()
+        writer.add(parse_rows(self.export_rows()))
+        writer.close()
+        self.assertEqual(TestPassPercent.objects.filter(batch__batch_id='ingest').count(), 2)
+        self.assertEqual(Batch.objects.get(batch_id='ingest').inspected, 10)
+
+    def test_staged_load_publishes_parts(self):
+        writer = StagingWriter()
+        writer.add(parse_rows(self.part_export_rows()))
+        writer.close()
+        self.assertEqual(MeasurementSketch.objects.filter(batch__batch_id='ingest').count(), 2)
+        values = sketches.percentiles(['dimension_envelope_mm'], [50],
+                                      date__year=2016, date__month=7)
+        self.assertAlmostEqual(values['dimension_envelope_mm'][0], 50, delta=0.5)
+
+    def test_staged_load_publishes_last_copy(self):
+        writer = StagingWriter()
+        writer.add(parse_rows(self.export_rows()))
+        rows = [row for row in self.export_rows() if row.get('overall_result') != 'Fail']
+        rows[0]['inspected'] = '6'
+        writer.add(parse_rows(rows))
+        writer.close()
+        self.assertEqual(Summary.objects.filter(batch__batch_id='ingest').count(), 1)
+        self.assertEqual(MeasurementMean.objects.filter(batch__batch_id='ingest').count(), 1)
+        self.assertEqual(Batch.objects.get(batch_id='ingest').inspected, 6)
+
+    def test_staged_load_rejects_invalid_segments(self):
+        rows = self.export_rows()
+        rows[0]['good_percent'] = '120'
+        writer = StagingWriter()
+        writer.add(parse_rows(rows))
+        with self.assertRaises(StagingError):
+            writer.close()
+        self.assertFalse(Summary.objects.filter(batch__batch_id='ingest').exists())
+
+
+class IngestBufferTests(TestCase):
+
+    def test_refuses_segments_that_do_not_fit(self):
+        buffer = IngestBuffer(batch_size=10, flush_seconds=3, max_pending=1)
+        with self.assertRaises(BufferTooLarge):
+            buffer.put([{}, {}])
+        # A segment already waiting
+        buffer._pending.append({})
+        with self.assertRaises(BufferFull) as raised:
+            buffer.put([{}])
+        self.assertEqual(raised.exception.retry_after, 3)
@@ -1,5 +1,5 @@
 from django.conf.urls import url
-from . import views
+from . import views, api
 
 urlpatterns = [
     url(r'^$', views.Years.as_view(), name='years'),
@@ -24,5 +24,64 @@ urlpatterns = [
         views.stats,
         kwargs={'segment': None},
         name='total_stats_report',
-    )
+    ),
+    url(r'^report/(?P<batch>[A-Za-z0-9]+)/$',
+        views.batch_report,
+        name='batch_report',
+        ),
+    url(r'^report/(?P<batch>[A-Za-z0-9]+)/(?P<segment>[0-9]+)/$',
+        views.batch_report,
+        name='segment_report',
+        ),
+    url(r'^report/(?P<batch>[A-Za-z0-9]+)/segments/$',
+        views.batch_report,
+        kwargs={'every_segment': True},
+        name='batch_segments_report',
+        ),
+    url(r'^capability/$',
+        views.capability,
+        name='capability_range',
+        ),
+    url(r'^capability/(?P<year>[0-9]{4})/(?P<month>[0-9]{2})/$',
+        views.capability,
+        name='month_capability',
+        ),
+    url(r'^capability/batch/(?P<batch>[A-Za-z0-9]+)/$',
+        views.capability,
+        name='batch_capability',
+        ),
+    url(r'^api/ingest/$',
+        api.ingest,
+        name='ingest',
+        ),
+    url(r'^api/(?P<year>[0-9]{4})/(?P<month>[0-9]{2})/$',
+        api.month_json,
+        name='month_report_list_json',
+        ),
+    url(r'^api/percentiles/(?P<year>[0-9]{4})/(?P<month>[0-9]{2})/$',
+        api.month_percentiles_json,
+        name='month_percentiles_json',
+        ),
+    url(r'^api/percentiles/batch/(?P<batch>[A-Za-z0-9]+)/$',
+        api.batch_percentiles_json,
+        name='batch_percentiles_json',
+        ),
+    url(r'^api/charts/(?P<metric>[a-z_]+)/(?P<batch>[A-Za-z0-9]+)/$',
+        api.chart_json,
+        name='chart_json',
+        ),
+    url(r'^api/batch/(?P<batch>[A-Za-z0-9]+)/$',
+        api.batch_summary_json,
+        name='batch_summary_json',
+        ),
+    url(
+        r'^api/stats/(?P<category>[A-Za-z\-_]+)/(?P<batch>[A-Za-z0-9]+)/(?P<segment>[0-9]+)/$',
+        api.stats_json,
+        name='stats_report_json',
+    ),
+    url(r'^api/stats/(?P<category>[A-Za-z\-_]+)/(?P<batch>[A-Za-z0-9]+)/$',
+        api.stats_json,
+        kwargs={'segment': None},
+        name='total_stats_report_json',
+        ),
 ]
\ No newline at end of file
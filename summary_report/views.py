@@ -1,9 +1,16 @@
+from datetime import date
 from django.views import generic
-from .models import Summary, MeasurementMean, MeasurementCount, TestPassPercent
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from .models import Batch, BatchMonth, Summary, StandardID
+from .counters import COUNTER_FIELDS
+from .rollups import report_stats, category_stats
+from .aggregates import CATEGORIES, CATEGORY_RESULTS, MEAN_FIELDS
+from .capability import capability_report, month_batches, month_dates, range_batches
+from . import archive, report_cache
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, render
-from itertools import chain
 
 
 class Years(generic.ListView):
@@ -11,18 +18,37 @@ class Years(generic.ListView):
     context_object_name = 'distinct_years'
 
     def get_queryset(self):
-        distinct_entries = Summary.objects.dates('date', 'year')
-        return [entry.year for entry in distinct_entries]
+        # Read from the calendar index, see counters.py
+        distinct_entries = (BatchMonth.objects
+                            .order_by('year')
+                            .values_list('year', flat=True)
+                            .distinct())
+        return list(distinct_entries)
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
         return super(Years, self).dispatch(*args, **kwargs)
 
 
-class ReportYearArchiveView(generic.YearArchiveView):
+class ReportYearArchiveView(generic.ListView):
     template_name = 'summary_report/months.html'
-    queryset = Summary.objects.all()
-    date_field = "date"
+    context_object_name = 'date_list'
+    allow_empty = False
+
+    def get_queryset(self):
+        query_year = int(self.kwargs['year'])
+
+        months = (BatchMonth.objects
+                  .filter(year=query_year)
+                  .order_by('month')
+                  .values_list('month', flat=True)
+                  .distinct())
+        return [date(query_year, month, 1) for month in months]
+
+    def get_context_data(self, **kwargs):
+        context = super(ReportYearArchiveView, self).get_context_data(**kwargs)
+        context['year'] = date(int(self.kwargs['year']), 1, 1)
+        return context
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
@@ -37,9 +63,10 @@ class ReportMonthArchiveView(generic.ListView):
         query_year = self.kwargs['year']
         query_month = self.kwargs['month']
 
-        batch_query = (Summary.objects
-                       .filter(date__year=query_year, date__month=query_month)
-                       .distinct('batch_id'))
+        batch_query = (BatchMonth.objects
+                       .filter(year=query_year, month=query_month)
+                       .select_related('batch')
+                       .order_by('batch__batch_id'))
         return batch_query
 
     def get_context_data(self, **kwargs):
@@ -53,37 +80,116 @@ class ReportMonthArchiveView(generic.ListView):
         return super(ReportMonthArchiveView, self).dispatch(*args, **kwargs)
 
 
+# Segments shown per page of the batch summary
+SEGMENTS_PER_PAGE = 50
+
+
+def batch_key(batch):
+    # Urls name batches by batch_id; rows reference them by their integer key
+    key = Batch.objects.filter(batch_id=batch).values_list('pk', flat=True).first()
+    if key is None:
+        raise Http404('No batch %s' % batch)
+    return key
+
+
+def segment_summaries(batch, summary_ids):
+    # {id: Summary} of segments of a batch, live or archived
+    if archive.is_archived(batch):
+        return {summary.pk: summary for summary in archive.summaries(batch)
+                if summary.pk in summary_ids}
+    return Summary.objects.filter(batch_id=batch).in_bulk(summary_ids)
+
+
+def batch_name(batch):
+    return Batch.objects.filter(pk=batch).values_list('batch_id', flat=True).get()
+
+
+def batch_totals(batch):
+    # Totals header of the batch summary, read from the running totals on Batch (see
+    # counters.py): {'sum_<count>': total, 'sum_<count>_percent': percent}
+    totals = {}
+    batch_counts = Batch.objects.filter(pk=batch).values(*COUNTER_FIELDS).first()
+    sum_map = {
+        'sum_inspected': 'inspected',
+        'sum_good': 'good',
+        'sum_fail_gen': 'fail_general',
+        'sum_fail_od': 'fail_od',
+        'sum_fail_backward': 'fail_backward',
+        'sum_n_a': 'n_a',
+    }
+    if batch_counts:
+        for sum_key, attr_val in sum_map.items():
+            totals[sum_key] = batch_counts[attr_val]
+        for sum_key in sum_map.keys():
+            try:
+                totals[sum_key+'_percent'] = totals[sum_key]/totals['sum_inspected'] * 100
+            except ZeroDivisionError:
+                totals[sum_key+'_percent'] = 0
+    return totals
+
+
+def _archived_page(batch, after, size, values):
+    # Page of an archived batch, from its cached segments
+    summaries = archive.summaries(batch)
+    start = 0
+    if after:
+        ids = [summary.pk for summary in summaries]
+        if not str(after).isdigit() or int(after) not in ids:
+            raise Http404
+        start = ids.index(int(after)) + 1
+    page = summaries[start:start + size]
+    next_after = page[-1].pk if start + size < len(summaries) else None
+    if values is not None:
+        page = [{field: getattr(summary, field) for field in values} for summary in page]
+    return page, next_after
+
+
+def segment_page(batch, after=None, size=SEGMENTS_PER_PAGE, values=None):
+    """
+    Keyset page of a batch's segments in (date, time) order, starting after the segment
+    with id `after`, so any page costs the same however long the batch is.
+    Returns (summaries, next_after), next_after being None on the last page.
+    """
+    if archive.is_archived(batch):
+        return _archived_page(batch, after, size, values)
+    summaries = Summary.objects.filter(batch_id=batch)
+    if after:
+        if not str(after).isdigit():
+            raise Http404
+        last = Summary.objects.filter(batch_id=batch, pk=after).values('date', 'time').first()
+        if last is None:
+            raise Http404
+        # A row comparison, which PostgreSQL reads as one range of the
+        # (batch, date, time, id) index
+        summaries = summaries.extra(where=['(date, time, id) > (%s, %s, %s)'],
+                                    params=[last['date'], last['time'], int(after)])
+    summaries = summaries.order_by('date', 'time', 'pk')
+    if values is not None:
+        summaries = summaries.values(*values)
+    summaries = list(summaries[:size + 1])
+    if len(summaries) > size:
+        summaries = summaries[:size]
+        last = summaries[-1]
+        return summaries, last['id'] if values is not None else last.pk
+    return summaries, None
+
+
 class BatchSummaryView(generic.ListView):
     template_name = 'summary_report/batch_summary.html'
     context_object_name = 'summary_data'
 
     def get_queryset(self):
-        query_batch = self.kwargs['batch']
+        self.batch = batch_key(self.kwargs['batch'])
 
-        summary_query = (Summary.objects.filter(batch_id=query_batch))
+        summary_query, self.next_after = segment_page(self.batch, self.request.GET.get('after'))
         return summary_query
 
     def get_context_data(self, **kwargs):
         context = super(BatchSummaryView, self).get_context_data(**kwargs)
         context['batch'] = self.kwargs['batch']
-        summaries = (Summary.objects.filter(batch_id=self.kwargs['batch']))
-        sum_map = {
-            'sum_inspected': 'inspected',
-            'sum_good': 'good',
-            'sum_fail_gen': 'fail_general',
-            'sum_fail_od': 'fail_od',
-            'sum_fail_backward': 'fail_backward',
-            'sum_n_a': 'n_a',
-        }
-        if summaries.exists():
-            for summary in summaries:
-                for sum_key, attr_val in sum_map.items():
-                    if sum_key not in context:
-                        context[sum_key] = getattr(summary, attr_val)
-                    else:
-                        context[sum_key] += getattr(summary, attr_val)
-            for sum_key in sum_map.keys():
-                context[sum_key+'_percent'] = context[sum_key]/context['sum_inspected'] * 100
+        context['after'] = self.request.GET.get('after')
+        context['next_after'] = self.next_after
+        context.update(batch_totals(self.batch))
         return context
 
     @method_decorator(login_required)
@@ -91,110 +197,18 @@ class BatchSummaryView(generic.ListView):
         return super(BatchSummaryView, self).dispatch(*args, **kwargs)
 
 
-@login_required
-def stats(request, category, batch, segment):
-    # filters is used to map url category to django object query: {category: filter_kwargs}
-    filters = {
-        'inspected': {},
-        'good': {'overall_result': 'Good'},
-        'fail': {'overall_result': 'Fail'},
-        'fail_od': {'overall_result': 'Fail - OD Envelope'},
-        'fail_backward': {'overall_result': 'backwards'},
-        'fail_na': {'overall_result': 'N/A'},
-    }
+CATEGORY_DISPLAY = {
+    'inspected': 'All Sensors',
+    'good': 'Good',
+    'fail': 'Failed (General)',
+    'fail_od': 'Failed (OD)',
+    'fail_backward': 'Failed (Backwards)',
+    'fail_na': 'Sensors Not Found/Not Valid',
+}
 
-    # add remaining filter elements to kwargs
-    for filter_dict in filters.values():
-        if segment:
-            filter_dict['summary'] = segment
-        else:
-            pass
-        filter_dict['batch_id'] = batch
-
-    # Pull report instances
-    means_instances = (MeasurementMean.objects
-                       .filter(**filters[category])
-                       .select_related('summary').all())
-    counts_instances = (MeasurementCount.objects
-                        .filter(**filters[category])
-                        .select_related('summary').all())
-    tests_instances = (TestPassPercent.objects
-                       .filter(**filters[category])
-                       .select_related('summary').all())
-
-    # weight_map used to determine weight of measurement/test when averaging.
-    weight_map = {
-        'Good': 'good',
-        'Fail': 'fail_general',
-        'Fail - OD Envelope': 'fail_od',
-        'Backwards': 'fail_backward',
-        'N/A': 'n_a',
-    }
-
-    # Get list of fields to average in MeasurementMeans and TestPasses
-    mean_fields = set(chain.from_iterable(
-        (field.name, field.attname) if hasattr(field, 'attname') else (field.name,)
-        for field in MeasurementMean._meta.get_fields()
-    ))
-    test_fields = set(chain.from_iterable(
-        (field.name, field.attname) if hasattr(field, 'attname') else (field.name,)
-        for field in TestPassPercent._meta.get_fields()
-    ))
-
-    # Discard non-value fields
-    discard_fields = ('id', 'summary', 'overall_result', 'batch', 'batch_id', 'summary_id')
-    for field in discard_fields:
-        mean_fields.discard(field)
-        test_fields.discard(field)
-
-    # Building counts totals for each field
-    counts_dict = {field: 0 for field in mean_fields}
-    for instance in counts_instances:
-        for field in mean_fields:
-            counts_dict[field] += getattr(instance, field)
-
-    # Means dict will hold the normalized value of each field calculated.
-    means_dict = {field: 0 for field in mean_fields}
-    for instance in means_instances:
-        # Pull the counts instance associated with this means instance
-        counts_instance = counts_instances.get(
-            batch_id=instance.batch_id, summary=instance.summary,
-            overall_result=instance.overall_result
-        )
-        for field in mean_fields:
-            # The value to be normalized
-            instance_val = getattr(instance, field)
-            # The count (weight) of this instance
-            instance_count = getattr(counts_instance, field)
-            # The calculation
-            try:
-                normalized_val = instance_val * instance_count / counts_dict[field]
-            except ZeroDivisionError:
-                normalized_val = 0
-            means_dict[field] += normalized_val
-
-    # Because we don't factor out non-zero values for tests, the count is easier to gather.
-    tests_count_sum = 0
-    summary_id = None
-    for instance in tests_instances:
-        # Get the count from the summary value
-        tests_count_sum += getattr(instance.summary, weight_map[instance.overall_result])
-        summary_id = instance.summary
-
-    # Normalize the tests averages
-    tests_dict = {field: 0 for field in test_fields}
-    for instance in tests_instances:
-        for field in test_fields:
-            instance_val = getattr(instance, field)
-            instance_weight = getattr(instance.summary,
-                                      weight_map[instance.overall_result])
-            try:
-                normalized_val = instance_val * instance_weight / tests_count_sum
-            except ZeroDivisionError:
-                normalized_val = 0
-            tests_dict[field] += normalized_val
 
-    # Dividing up fields by station
+def station_context(means_dict, counts_dict, tests_dict):
+    # Dividing up fields by station, as rendered by the report templates
 
     round_means_fields = [
         'round_inner_bright_area',
@@ -412,25 +426,113 @@ def stats(request, category, batch, segment):
                         'tests_values': cosmetic_tests_values,
                         }
 
-    category_display_map = {
-        'inspected': 'All Sensors',
-        'good': 'Good',
-        'fail': 'Failed (General)',
-        'fail_od': 'Failed (OD)',
-        'fail_backward': 'Failed (Backwards)',
-        'fail_na': 'Sensors Not Found/Not Valid',
-    }
-    display_category = category_display_map[category]
+    return {'round': round_context,
+            'flat': flat_context,
+            'dimension': dimension_context,
+            'cosmetic': cosmetic_context,
+            }
+
+
+def stats_context(category, batch, segment):
+    # Read the precomputed rollup, see rollups.py
+    means_dict, counts_dict, tests_dict, tests_count_sum = report_stats(category, batch, segment)
+
+    display_category = CATEGORY_DISPLAY[category]
 
     # Rename segment if segment is None (which happens for job total reports)
-    segment = 'Job Total' if not segment else summary_id
-
-    return render(request, 'summary_report/report.html', {'round': round_context,
-                                                          'flat': flat_context,
-                                                          'dimension': dimension_context,
-                                                          'cosmetic': cosmetic_context,
-                                                          'batch': batch,
-                                                          'segment': segment,
-                                                          'category': display_category,
-                                                          'count': tests_count_sum,
-                                                          })
\ No newline at end of file
+    segment = ('Job Total' if not segment
+               else segment_summaries(batch, [int(segment)]).get(int(segment)))
+
+    context = station_context(means_dict, counts_dict, tests_dict)
+    context.update({'batch': batch_name(batch),
+                    'segment': segment,
+                    'category': display_category,
+                    'count': tests_count_sum,
+                    })
+    return context
+
+
+@login_required
+def stats(request, category, batch, segment):
+    # Report contexts are cached until the batch's rows change, see report_cache.py
+    context = report_cache.get_report(category, batch_key(batch), segment, stats_context)
+    return render(request, 'summary_report/report.html', context)
+
+
+def batch_report_context(batch, segment, every_segment):
+    report = category_stats(batch, segment, every_segment)
+    summaries = segment_summaries(batch, [summary_id for summary_id in report if summary_id])
+    if any(summary_id not in summaries for summary_id in report if summary_id):
+        # A segment of another batch, or none
+        raise Http404
+    segments = []
+    for summary_id in sorted(report, key=lambda key: (summaries[key].date, summaries[key].time)
+                             if key else ()):
+        categories = []
+        for category in CATEGORIES:
+            means_dict, counts_dict, tests_dict, tests_count_sum = report[summary_id][category]
+            context = station_context(means_dict, counts_dict, tests_dict)
+            context.update({'category': CATEGORY_DISPLAY[category],
+                            'count': tests_count_sum,
+                            })
+            categories.append(context)
+        segments.append({'segment': summaries[summary_id] if summary_id else 'Job Total',
+                         'categories': categories,
+                         })
+    return {'batch': batch_name(batch), 'segments': segments}
+
+
+@login_required
+def batch_report(request, batch, segment=None, every_segment=False):
+    # Every category of a batch (or segment) on one page, see rollups.category_stats
+    batch = batch_key(batch)
+    context = report_cache.cached(
+        'segments' if every_segment else 'all',
+        lambda: batch_report_context(batch, segment, every_segment),
+        batch, segment,
+    )
+    return render(request, 'summary_report/batch_report.html', context)
+
+
+@login_required
+def capability(request, batch=None, year=None, month=None):
+    # Cp/Cpk of a batch, a month, or ?start=&end= dates against ?standard=<StandardID pk>
+    # (the first standard by default), see capability.py
+    standards = StandardID.objects.order_by('pk')
+    if 'standard' in request.GET:
+        standard = get_object_or_404(StandardID, pk=request.GET['standard'])
+    else:
+        standard = standards.first()
+        if standard is None:
+            raise Http404('No measurement standards')
+    category = request.GET.get('category', 'inspected')
+    if category not in CATEGORY_RESULTS:
+        raise Http404('Unknown category')
+
+    # Months and ranges cover the segments dated in them, not their batches' other segments
+    dates = None
+    if batch is not None:
+        batches, scope = [batch_key(batch)], batch
+    elif year is not None:
+        batches, scope = month_batches(year, month), '%s-%s' % (year, month)
+        dates = month_dates(year, month)
+    else:
+        field = Summary._meta.get_field('date')
+        try:
+            start = field.to_python(request.GET.get('start'))
+            end = field.to_python(request.GET.get('end'))
+        except ValidationError:
+            raise Http404('Invalid date range')
+        if start is None or end is None:
+            raise Http404('Invalid date range')
+        batches, scope = range_batches(start, end), '%s - %s' % (start, end)
+        dates = start, end
+
+    report = capability_report(batches, standard, category, dates)
+    return render(request, 'summary_report/capability.html', {
+        'scope': scope,
+        'standard': standard,
+        'standards': standards,
+        'category': CATEGORY_DISPLAY[category],
+        'rows': [dict(report[field], field=field) for field in MEAN_FIELDS],
+    })